@@ -0,0 +1,202 @@
+from __future__ import print_function
+
+import argparse
+import json
+import multiprocessing
+import numpy as np
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tensorflow as tf
+import time
+
+from ResNet import ROOT_PATH, set_meta, Meta, FileProducer, Preprocess, Batch, Net, ResNet50
+
+
+def get_mem_total():
+    if os.path.isfile('/proc/meminfo'):
+        for line in open('/proc/meminfo'):
+            if line.startswith('MemTotal:'):
+                return int(line.split()[1]) * 1024
+    return None
+
+
+class Autotune(object):
+    CONFIG_DIR = os.path.join(ROOT_PATH, 'autotune')
+    WARMUP = 5.0
+    WINDOW = 10.0
+    MIN_GAIN = 0.05
+    MEM_FRAC = 0.5
+    BUFFER_FRAC = 0.25
+    MAX_MIN_AFTER_DEQUEUE = 16384
+
+    DEFAULT_CONFIG = dict(
+        capacity=FileProducer.CAPACITY,
+        num_train_inputs=FileProducer.NUM_TRAIN_INPUTS,
+        train_capacity=Batch.TRAIN_CAPACITY,
+        min_after_dequeue=Batch.MIN_AFTER_DEQUEUE,
+        num_intra_threads=Net.NUM_INTRA_THREADS,
+        num_inter_threads=Net.NUM_INTER_THREADS)
+
+    @staticmethod
+    def get_config_path(config_dir=CONFIG_DIR):
+        return os.path.join(config_dir, '%s.json' % socket.gethostname())
+
+    @staticmethod
+    def load(config_dir=CONFIG_DIR):
+        config_path = Autotune.get_config_path(config_dir)
+        if not os.path.isfile(config_path):
+            return None
+
+        config = dict(Autotune.DEFAULT_CONFIG)
+        with open(config_path, 'r') as f:
+            config.update(json.load(f))
+        print('Autotune config loaded from %s' % config_path)
+        return config
+
+    @staticmethod
+    def save(config, config_dir=CONFIG_DIR):
+        if not os.path.isdir(config_dir):
+            os.makedirs(config_dir)
+
+        config_path = Autotune.get_config_path(config_dir)
+        with open(config_path, 'w') as f:
+            json.dump(config, f, indent=4, sort_keys=True)
+        print('Autotune config saved to %s' % config_path)
+
+    def __init__(self,
+                 image_dir,
+                 preprocess=None,
+                 batch_size=Batch.BATCH_SIZE,
+                 warmup=WARMUP,
+                 window=WINDOW,
+                 min_gain=MIN_GAIN,
+                 mem_frac=MEM_FRAC,
+                 buffer_frac=BUFFER_FRAC):
+
+        self.image_dir = image_dir
+        self.preprocess = Preprocess() if preprocess is None else preprocess
+        self.batch_size = batch_size
+        self.warmup = warmup
+        self.window = window
+        self.min_gain = min_gain
+        self.mem_frac = mem_frac
+        self.buffer_frac = buffer_frac
+
+        num_cpus = multiprocessing.cpu_count()
+        self.candidates = [
+            ('num_train_inputs', sorted(set([2, 4, 8, 16, num_cpus]))),
+            ('capacity', [16, 32, 64, 128]),
+            ('num_inter_threads', sorted(set([0, 2, max(1, num_cpus / 2), num_cpus]))),
+            ('num_intra_threads', sorted(set([0, 1, max(1, num_cpus / 2), num_cpus])))]
+
+    def run_trial(self, config):
+        with tf.Graph().as_default():
+            producer = FileProducer(
+                capacity=config['capacity'],
+                num_train_inputs=config['num_train_inputs'])
+            batch = Batch(
+                batch_size=self.batch_size,
+                train_capacity=2 * self.batch_size,
+                min_after_dequeue=self.batch_size)
+            net = ResNet50(
+                learning_modes=dict(normal=1.0, slow=1.0),
+                num_intra_threads=config['num_intra_threads'],
+                num_inter_threads=config['num_inter_threads'],
+                resnet_params_path=None,
+                is_train=True)
+
+            # Time full training steps, since the thread pools are shared with the convolutions
+            producer.trainBlob(image_dir=self.image_dir, check=False, decode_size=self.preprocess.train_decode_size).func(self.preprocess.train).func(batch.train).func(self.preprocess.normalize).func(net.build)
+            sess = net.sess
+            sess.run(net.phase_assign, feed_dict={net.phase: Net.Phase.TRAIN.value})
+            coord = tf.train.Coordinator()
+            threads = tf.train.start_queue_runners(sess=sess, coord=coord)
+
+            start = time.time()
+            while time.time() - start < self.warmup:
+                sess.run(net.train_op)
+
+            num_images = 0
+            start = time.time()
+            while time.time() - start < self.window:
+                sess.run(net.train_op)
+                num_images += self.batch_size
+            speed = num_images / (time.time() - start)
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+            coord.request_stop()
+            coord.join(threads, stop_grace_period_secs=5)
+            sess.close()
+
+        return (speed, rss)
+
+    def trial(self, config):
+        args = [
+            sys.executable, os.path.abspath(__file__), self.image_dir, json.dumps(config),
+            '--train_size_range', str(self.preprocess.train_size_range[0]), str(self.preprocess.train_size_range[1]),
+            '--batch_size', str(self.batch_size),
+            '--warmup', str(self.warmup),
+            '--window', str(self.window)]
+
+        try:
+            result = json.loads(subprocess.check_output(args).strip().split('\n')[-1])
+        except (subprocess.CalledProcessError, ValueError):
+            print('Autotune trial %s failed' % json.dumps(config, sort_keys=True))
+            return (0.0, None)
+
+        print('Autotune trial %s: %.1f images/s, peak %.1f MB' % (json.dumps(config, sort_keys=True), result['speed'], result['rss'] / 2. ** 20))
+        return (result['speed'], result['rss'])
+
+    def search(self, config=None, max_rss=None):
+        config = dict(Autotune.DEFAULT_CONFIG if config is None else config)
+        if (max_rss is None) and (get_mem_total() is not None):
+            max_rss = int(self.mem_frac * get_mem_total())
+        if max_rss is not None:
+            print('Autotune memory budget: %.1f MB' % (max_rss / 2. ** 20))
+
+        (best_speed, _) = self.trial(config)
+        for (key, values) in self.candidates:
+            for value in values:
+                if value == config[key]:
+                    continue
+
+                config_ = dict(config)
+                config_[key] = value
+                (speed, rss) = self.trial(config_)
+                if (speed > best_speed * (1 + self.min_gain)) and ((max_rss is None) or ((rss is not None) and (rss < max_rss))):
+                    (config, best_speed) = (config_, speed)
+
+        if max_rss is not None:
+            example_bytes = np.prod(self.preprocess.shape) * np.dtype(np.uint8).itemsize
+            min_after_dequeue = int(self.buffer_frac * max_rss / example_bytes)
+            min_after_dequeue = 2 ** int(np.log2(max(min_after_dequeue, self.batch_size)))
+            config['min_after_dequeue'] = min(min_after_dequeue, Autotune.MAX_MIN_AFTER_DEQUEUE)
+            config['train_capacity'] = config['min_after_dequeue'] + 16 * self.batch_size
+
+        print('Autotune best: %s, %.1f images/s' % (json.dumps(config, sort_keys=True), best_speed))
+        return config
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run one Autotune pipeline trial in a fresh process and print its speed and peak RSS as JSON.')
+    parser.add_argument('image_dir')
+    parser.add_argument('config', help='Pipeline config as JSON')
+    parser.add_argument('--train_size_range', type=int, nargs=2, default=Preprocess.TRAIN_SIZE_RANGE)
+    parser.add_argument('--batch_size', type=int, default=Batch.BATCH_SIZE)
+    parser.add_argument('--warmup', type=float, default=Autotune.WARMUP)
+    parser.add_argument('--window', type=float, default=Autotune.WINDOW)
+    args = parser.parse_args()
+
+    set_meta(Meta(class_names=Meta.list_class_names(args.image_dir)))
+
+    autotune = Autotune(
+        image_dir=args.image_dir,
+        preprocess=Preprocess(train_size_range=tuple(args.train_size_range)),
+        batch_size=args.batch_size,
+        warmup=args.warmup,
+        window=args.window)
+    (speed, rss) = autotune.run_trial(json.loads(args.config))
+    print(json.dumps(dict(speed=speed, rss=rss)))
@@ -0,0 +1,105 @@
+from __future__ import print_function
+
+import numpy as np
+import os
+import tensorflow as tf
+
+DECODE_SIZE = 64
+DCT_SIZE = 32
+HASH_SIZE = 8
+MAX_DISTANCE = 6
+WINDOW = 64
+DUPLICATES_FILENAME = 'duplicates.txt'
+
+POPCOUNT = np.array([bin(value).count('1') for value in xrange(256)], dtype=np.uint8)
+
+
+def dct_matrix(size):
+    (k, n) = np.meshgrid(np.arange(size), np.arange(size), indexing='ij')
+    matrix = np.sqrt(2.0 / size) * np.cos(np.pi * (2 * n + 1) * k / (2.0 * size))
+    matrix[0] /= np.sqrt(2.0)
+    return matrix.astype(np.float32)
+
+
+def phash(image, dct_size=DCT_SIZE, hash_size=HASH_SIZE):
+    image = tf.reduce_mean(tf.to_float(image), 2, keep_dims=True)
+    image = tf.image.resize_bilinear(tf.expand_dims(image, 0), (dct_size, dct_size))
+    image = tf.reshape(image, (dct_size, dct_size))
+
+    matrix = tf.constant(dct_matrix(dct_size))
+    coeffs = tf.matmul(tf.matmul(matrix, image), matrix, transpose_b=True)
+    coeffs = tf.reshape(tf.slice(coeffs, (0, 0), (hash_size, hash_size)), (-1,))
+
+    median = tf.nn.top_k(coeffs, hash_size * hash_size / 2)[0][hash_size * hash_size / 2 - 1]
+    bits = tf.greater_equal(coeffs, median)
+    bits.set_shape((hash_size * hash_size,))
+    return bits
+
+
+def pack(bits):
+    return np.packbits(bits, axis=1).view(np.uint64)[:, 0]
+
+
+def popcount(values):
+    return np.sum(POPCOUNT[values.view(np.uint8).reshape(-1, 8)], axis=1)
+
+
+def find_pairs(hashes, max_distance=MAX_DISTANCE, window=WINDOW):
+    num_bands = max_distance + 1
+    band_edges = np.linspace(0, 64, num_bands + 1).astype(np.uint64)
+
+    pairs = list()
+    for (band_begin, band_end) in zip(band_edges[:-1], band_edges[1:]):
+        mask = np.uint64((1 << int(band_end - band_begin)) - 1)
+        keys = (hashes >> band_begin) & mask
+        order = np.argsort(keys, kind='mergesort')
+        keys = keys[order]
+
+        for offset in xrange(1, min(window, len(order) - 1) + 1):
+            is_same = keys[offset:] == keys[:-offset]
+            if not np.any(is_same):
+                break
+            (first, second) = (order[:-offset][is_same], order[offset:][is_same])
+            is_close = popcount(hashes[first] ^ hashes[second]) <= max_distance
+            pairs.append(np.stack([first[is_close], second[is_close]], axis=1))
+
+    if not pairs:
+        return np.zeros((0, 2), dtype=np.int64)
+    return np.unique(np.sort(np.concatenate(pairs), axis=1).view(np.dtype((np.void, 16)))).view(np.int64).reshape(-1, 2)
+
+
+def connected_components(num_nodes, pairs):
+    labels = np.arange(num_nodes)
+    while True:
+        labels_ = np.minimum(labels[pairs[:, 0]], labels[pairs[:, 1]])
+        new_labels = labels.copy()
+        np.minimum.at(new_labels, pairs[:, 0], labels_)
+        np.minimum.at(new_labels, pairs[:, 1], labels_)
+        new_labels = new_labels[new_labels]
+        if np.array_equal(new_labels, labels):
+            return labels
+        labels = new_labels
+
+
+def select_representatives(labels, scores):
+    order = np.lexsort((-scores, labels))
+    is_first = np.concatenate([[True], labels[order[1:]] != labels[order[:-1]]])
+    keep = np.zeros(len(labels), dtype=np.bool)
+    keep[order[is_first]] = True
+    return keep
+
+
+def is_test(filename, subsample_size):
+    return hash(os.path.basename(filename)) % subsample_size == 0
+
+
+def save_duplicates(path, filename_list, labels, keep):
+    with open(path, 'w') as f:
+        representatives = {label: filename for (label, filename, keep_) in zip(labels, filename_list, keep) if keep_}
+        for (label, filename, keep_) in zip(labels, filename_list, keep):
+            if not keep_:
+                f.write('%s\t%s\n' % (filename, representatives[label]))
+
+
+def load_duplicates(path):
+    return set(line.split('\t')[0] for line in open(path) if line.strip())
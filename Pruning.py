@@ -0,0 +1,85 @@
+from __future__ import print_function
+
+import json
+import numpy as np
+import scipy.io
+import tensorflow as tf
+
+BLOCKS = [('2', 3), ('3', 4), ('4', 6), ('5', 3)]
+PARAM_INDICES = dict(weight=0, bias=1, mean=0, variance=1, scale=0, offset=1)
+CHANNELS_FILENAME = 'channels.json'
+EPSILON = 1e-5
+
+
+def unit_names(blocks=BLOCKS):
+    return ['%s%c' % (name, ord('a') + num_unit) for (name, num_units) in blocks for num_unit in xrange(num_units)]
+
+
+def load_params(model_path):
+    reader = tf.train.NewCheckpointReader(model_path)
+
+    params = dict()
+    for var_name in reader.get_variable_to_shape_map():
+        names = var_name.split('/')
+        if (len(names) != 3) or (names[2] not in PARAM_INDICES):
+            continue
+        (_, layer_name, param_name) = names
+        params.setdefault(layer_name, dict())[PARAM_INDICES[param_name]] = reader.get_tensor(var_name)
+
+    return params
+
+
+def save_params(params, path):
+    mat = dict()
+    for (layer_name, values) in params.iteritems():
+        cell = np.empty((len(values), 1), dtype=np.object)
+        for (index, value) in values.iteritems():
+            cell[index, 0] = value[:, None] if value.ndim == 1 else value
+        mat[layer_name] = cell
+    scipy.io.savemat(path, mat)
+
+
+def prune_channels(params, conv_name, norm_name, next_conv_name, keep):
+    params[conv_name][0] = params[conv_name][0][..., keep]
+    for layer_name in ['bn%s' % norm_name, 'scale%s' % norm_name]:
+        for index in params[layer_name]:
+            params[layer_name][index] = params[layer_name][index][keep]
+    params[next_conv_name][0] = params[next_conv_name][0][:, :, keep, :]
+
+
+def get_gains(params, norm_name, epsilon=EPSILON):
+    scale = params['scale%s' % norm_name][0]
+    variance = params['bn%s' % norm_name][1]
+    return np.abs(scale) / np.sqrt(variance + epsilon)
+
+
+def prune(params, ratio, blocks=BLOCKS, epsilon=EPSILON):
+    channels = dict()
+    for name in unit_names(blocks):
+        num_channels = list()
+        for (branch, next_branch) in [('2a', '2b'), ('2b', '2c')]:
+            gains = get_gains(params, '%s_branch%s' % (name, branch), epsilon=epsilon)
+            num_keep = max(1, int(round(len(gains) * (1 - ratio))))
+            keep = np.sort(np.argsort(-gains)[:num_keep])
+
+            prune_channels(
+                params,
+                conv_name='res%s_branch%s' % (name, branch),
+                norm_name='%s_branch%s' % (name, branch),
+                next_conv_name='res%s_branch%s' % (name, next_branch),
+                keep=keep)
+            num_channels.append(num_keep)
+
+        channels[name] = tuple(num_channels)
+
+    return channels
+
+
+def save_channels(channels, path):
+    with open(path, 'w') as f:
+        json.dump(channels, f, indent=4, sort_keys=True)
+
+
+def load_channels(path):
+    with open(path, 'r') as f:
+        return {name: tuple(value) for (name, value) in json.load(f).iteritems()}
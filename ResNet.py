@@ -1,14 +1,19 @@
 from __future__ import print_function
 
 import enum
+import json
 import numpy as np
 import os
 import scipy.io
+import struct
 import subprocess
 import sys
 import tensorflow as tf
+import threading
 import time
 
+import Pruning
+
 ROOT_PATH = os.path.dirname(__file__)
 DEEPBOX_PATH = os.path.join(ROOT_PATH, 'DeepBox')
 if DEEPBOX_PATH not in sys.path:
@@ -52,18 +57,30 @@ class Meta(object):
     CLASS_NAMES = list()
 
     @staticmethod
-    def train(image_dir, working_dir=WORKING_DIR, classnames_filename=CLASSNAMES_FILENAME):
-        if not os.path.isdir(working_dir):
-            os.makedirs(working_dir)
-
+    def list_class_names(image_dir):
         class_names = list()
         for class_name in os.listdir(image_dir):
             class_dir = os.path.join(image_dir, class_name)
             if not class_name.startswith('.') and os.path.isdir(class_dir):
                 class_names.append(class_name)
-        np.savetxt(os.path.join(working_dir, classnames_filename), class_names, delimiter=',', fmt='%s')
+        return class_names
 
-        return Meta(working_dir=working_dir, class_names=class_names)
+    @staticmethod
+    def train(image_dir, working_dir=WORKING_DIR, classnames_filename=CLASSNAMES_FILENAME):
+        class_names = Meta.list_class_names(image_dir)
+
+        meta = Meta(working_dir=working_dir, class_names=class_names)
+        meta.save(classnames_filename=classnames_filename)
+        return meta
+
+    @staticmethod
+    def incremental(image_dir, source_dir, working_dir=WORKING_DIR, classnames_filename=CLASSNAMES_FILENAME):
+        class_names = list(Meta.test(working_dir=source_dir, classnames_filename=classnames_filename).class_names)
+        new_class_names = sorted(set(Meta.list_class_names(image_dir)) - set(class_names))
+
+        meta = Meta(working_dir=working_dir, class_names=class_names + new_class_names)
+        meta.save(classnames_filename=classnames_filename)
+        return meta
 
     @staticmethod
     def test(working_dir=WORKING_DIR, classnames_filename=CLASSNAMES_FILENAME):
@@ -77,8 +94,101 @@ class Meta(object):
         self.working_dir = working_dir
         self.class_names = class_names
 
+    def save(self, classnames_filename=CLASSNAMES_FILENAME):
+        if not os.path.isdir(self.working_dir):
+            os.makedirs(self.working_dir)
+
+        np.savetxt(os.path.join(self.working_dir, classnames_filename), self.class_names, delimiter=',', fmt='%s')
+
 
 class ImageUtil(object):
+    JPEG_RATIOS = (8, 4, 2)
+    JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - set([0xC4, 0xC8, 0xCC])
+    JPEG_CHANNELS = (1, 3)
+
+    @staticmethod
+    def get_jpeg_sof(contents):
+        # Unpack the headers in place, copying the whole file here would hold the GIL for every image
+        if contents[:2] != b'\xff\xd8':
+            return None
+
+        pos = 2
+        while pos + 4 <= len(contents):
+            (prefix, marker, length) = struct.unpack_from('>BBH', contents, pos)
+            if prefix != 0xFF:
+                return None
+            if marker == 0xFF:
+                pos += 1
+                continue
+            if marker == 0xD8 or 0xD0 <= marker <= 0xD7:
+                pos += 2
+                continue
+
+            if marker in ImageUtil.JPEG_SOF_MARKERS:
+                if pos + 10 > len(contents):
+                    return None
+                (height, width, num_channels) = struct.unpack_from('>HHB', contents, pos + 5)
+                return (pos, height, width, num_channels)
+            pos += 2 + length
+        return None
+
+    @staticmethod
+    def get_jpeg_size(contents):
+        sof = ImageUtil.get_jpeg_sof(contents)
+        if sof is None:
+            return None
+        return sof[1:3]
+
+    @staticmethod
+    def is_valid_jpeg(contents, channels=JPEG_CHANNELS):
+        sof = ImageUtil.get_jpeg_sof(contents)
+        if sof is None:
+            return False
+        (pos, height, width, num_channels) = sof
+        return (height > 0) and (width > 0) and (num_channels in channels) and (contents.rfind(b'\xff\xd9', pos) >= 0)
+
+    @staticmethod
+    def read_jpeg(filename):
+        try:
+            with open(filename, 'rb') as f:
+                contents = f.read()
+        except (IOError, OSError):
+            return (b'', False)
+        return (contents, ImageUtil.is_valid_jpeg(contents))
+
+    @staticmethod
+    def get_jpeg_ratio(contents, size, ratios=JPEG_RATIOS):
+        jpeg_size = ImageUtil.get_jpeg_size(contents)
+        if jpeg_size is not None:
+            shorter_size = min(jpeg_size)
+            for ratio in ratios:
+                if shorter_size >= size * ratio:
+                    return np.int32(ratio)
+        return np.int32(1)
+
+    @staticmethod
+    def decode_jpeg(value, size=None, ratios=JPEG_RATIOS):
+        if size is None:
+            return tf.image.decode_jpeg(value, channels=3)
+
+        ratio = tf.py_func(lambda contents: ImageUtil.get_jpeg_ratio(contents, size, ratios=ratios), [value], [tf.int32], name='jpeg_ratio')[0]
+        ratio.set_shape(())
+
+        pred_fn_pairs = [(tf.equal(ratio, ratio_), lambda ratio_=ratio_: tf.image.decode_jpeg(value, channels=3, ratio=ratio_)) for ratio_ in ratios]
+        return tf.case(pred_fn_pairs, default=lambda: tf.image.decode_jpeg(value, channels=3))
+
+    @staticmethod
+    def read_decode_jpeg(filename, size=None, ratios=JPEG_RATIOS):
+        (value, is_valid) = tf.py_func(ImageUtil.read_jpeg, [filename], [tf.string, tf.bool], name='read_jpeg')
+        value.set_shape(())
+        is_valid.set_shape(())
+
+        image = tf.cond(
+            is_valid,
+            lambda: ImageUtil.decode_jpeg(value, size=size, ratios=ratios),
+            lambda: tf.zeros((1, 1, 3), dtype=tf.uint8))
+        return (image, is_valid)
+
     @staticmethod
     def get_shape(value):
         return tuple(value.get_shape().as_list())
@@ -124,7 +234,10 @@ class ImageUtil(object):
             value,
             tf.pack((offset_height, offset_width, 0)),
             tf.pack((size, size, -1)))
-        value.set_shape((size, size, 3))
+        if isinstance(size, int):
+            value.set_shape((size, size, 3))
+        else:
+            value.set_shape((None, None, 3))
         return value
 
     @staticmethod
@@ -138,12 +251,22 @@ class ImageUtil(object):
         value = tf.image.random_contrast(value, lower=contrast_range[0], upper=contrast_range[1])
         return value
 
+    @staticmethod
+    def to_uint8(value):
+        if value.dtype == tf.uint8:
+            return value
+        value = tf.clip_by_value(tf.round(value), 0.0, 255.0)
+        value = tf.cast(value, tf.uint8)
+        return value
+
 
 class Blob(object):
     class Content(enum.Enum):
         IMAGE_LABEL = 0
         VALUE = 1
 
+    EXTRA_FIELDS = ('weights', 'sizes')
+
     def __init__(self, **kwargs):
         assert ('images' in kwargs) + ('values' in kwargs) == 1, 'Too many arguments!'
 
@@ -157,13 +280,21 @@ class Blob(object):
             self.content = Blob.Content.IMAGE_LABEL
             self.images = images
             self.labels = labels
+            for field in Blob.EXTRA_FIELDS:
+                setattr(self, field, prob_list(kwargs[field]) if field in kwargs else None)
         elif 'values' in kwargs:
             values = prob_list(kwargs['values'])
             self.content = Blob.Content.VALUE
             self.values = values
 
+    def extras(self):
+        return {field: getattr(self, field) for field in Blob.EXTRA_FIELDS if getattr(self, field) is not None}
+
+    def extra_fields(self):
+        return [field for field in Blob.EXTRA_FIELDS if getattr(self, field) is not None]
+
     def as_tuple_list(self):
-        return zip(self.images, self.labels)
+        return zip(self.images, self.labels, *[getattr(self, field) for field in self.extra_fields()])
 
     def func(self, f):
         return f(self)
@@ -205,16 +336,43 @@ class SimpleProducer(BaseProducer):
 
 class QueueProducer(BaseProducer):
     CAPACITY = 1024
+    FEED_SIZE = 64
 
-    def __init__(self, capacity=CAPACITY):
+    def __init__(self, capacity=CAPACITY, feed_size=FEED_SIZE):
         self.capacity = capacity
+        self.feed_size = feed_size
+
+    def _enqueue_packed(self):
+        num_images = tf.shape(self.shapes)[0]
+
+        def body(num_image):
+            offset = self.offsets[num_image]
+            size = self.offsets[num_image + 1] - offset
+            image = tf.reshape(tf.slice(self.packed, tf.pack([offset]), tf.pack([size])), self.shapes[num_image])
+            with tf.control_dependencies([self.queue.enqueue([image])]):
+                return num_image + 1
+
+        return tf.while_loop(lambda num_image: tf.less(num_image, num_images), body, [tf.constant(0)])
 
     def blob(self, name='image', shape=None, dtype=tf.float32):
+        self.dtype = dtype
         self.placeholder = tf.placeholder(
             name=name,
             shape=shape,
             dtype=dtype)
         (self.queue, self.enqueue) = self.get_queue_enqueue(values=[self.placeholder], dtype=dtype, shape=shape, auto=False)
+
+        self.images = tf.placeholder(
+            name='%s_many' % name,
+            shape=None if shape is None else (None,) + tuple(shape),
+            dtype=dtype)
+        self.enqueue_many = self.queue.enqueue_many([self.images])
+
+        self.packed = tf.placeholder(name='%s_packed' % name, shape=(None,), dtype=dtype)
+        self.offsets = tf.placeholder(name='%s_offsets' % name, shape=(None,), dtype=tf.int32)
+        self.shapes = tf.placeholder(name='%s_shapes' % name, shape=(None, 3), dtype=tf.int32)
+        self.enqueue_packed = self._enqueue_packed()
+
         image = self.queue.dequeue()
         return Blob(images=image)
 
@@ -223,6 +381,46 @@ class QueueProducer(BaseProducer):
             feed_dict={self.placeholder: image},
             fetch=dict(queue_producer_enqueue=self.enqueue))
 
+    def kwargs_many(self, images):
+        if isinstance(images, np.ndarray):
+            images = np.ascontiguousarray(images, dtype=self.dtype.as_numpy_dtype)
+            return dict(
+                feed_dict={self.images: images},
+                fetch=dict(queue_producer_enqueue_many=self.enqueue_many))
+
+        shapes = np.array([image.shape for image in images], dtype=np.int32)
+        offsets = np.zeros(len(images) + 1, dtype=np.int32)
+        np.cumsum(np.prod(shapes, axis=1), out=offsets[1:])
+        packed = np.empty(offsets[-1], dtype=self.dtype.as_numpy_dtype)
+        for (image, offset_begin, offset_end) in zip(images, offsets[:-1], offsets[1:]):
+            packed[offset_begin:offset_end] = image.ravel()
+
+        return dict(
+            feed_dict={self.packed: packed, self.offsets: offsets, self.shapes: shapes},
+            fetch=dict(queue_producer_enqueue_packed=self.enqueue_packed))
+
+    def feed(self, sess, iterator):
+        def run(images):
+            if all(image.shape == images[0].shape for image in images):
+                images = np.stack(images)
+            kwargs = self.kwargs_many(images)
+            sess.run(kwargs['fetch'], feed_dict=kwargs['feed_dict'])
+
+        def loop():
+            images = list()
+            for image in iterator:
+                images.append(image)
+                if len(images) == self.feed_size:
+                    run(images)
+                    images = list()
+            if images:
+                run(images)
+
+        thread = threading.Thread(target=loop)
+        thread.daemon = True
+        thread.start()
+        return thread
+
 
 class FileProducer(BaseProducer):
     CAPACITY = 32
@@ -234,33 +432,43 @@ class FileProducer(BaseProducer):
                  capacity=CAPACITY,
                  num_train_inputs=NUM_TRAIN_INPUTS,
                  num_test_inputs=NUM_TEST_INPUTS,
-                 subsample_size=SUBSAMPLE_SIZE):
+                 subsample_size=SUBSAMPLE_SIZE,
+                 exclude_filenames=None):
 
         self.capacity = capacity
         self.num_train_inputs = num_train_inputs
         self.num_test_inputs = num_test_inputs
         self.subsample_size = subsample_size
+        self.exclude_filenames = set() if exclude_filenames is None else set(map(FileProducer.normalize_path, exclude_filenames))
 
-    def _blob(self,
-              image_dir,
-              num_inputs=1,
-              subsample_divisible=True,
-              check=False,
-              shuffle=False):
+    @staticmethod
+    def normalize_path(path):
+        return os.path.abspath(os.path.normpath(path))
 
+    def list_files(self, image_dir, subsample_divisible=True, check=False, class_limits=None):
         filename_list = list()
         classname_list = list()
 
         for class_name in META.class_names:
             class_dir = os.path.join(image_dir, class_name)
+            class_filename_list = list()
             for (file_dir, _, file_names) in os.walk(class_dir):
                 for file_name in file_names:
                     if not file_name.endswith('.jpg'):
                         continue
                     if (hash(file_name) % self.subsample_size == 0) != subsample_divisible:
                         continue
-                    filename_list.append(os.path.join(file_dir, file_name))
-                    classname_list.append(class_name)
+                    if FileProducer.normalize_path(os.path.join(file_dir, file_name)) in self.exclude_filenames:
+                        continue
+                    class_filename_list.append(os.path.join(file_dir, file_name))
+
+            if (class_limits is not None) and (class_name in class_limits):
+                class_filename_list = sorted(class_filename_list)
+                perm = np.random.RandomState(0).permutation(len(class_filename_list))[:class_limits[class_name]]
+                class_filename_list = map(class_filename_list.__getitem__, np.sort(perm))
+
+            filename_list.extend(class_filename_list)
+            classname_list.extend([class_name] * len(class_filename_list))
 
         label_list = map(META.class_names.index, classname_list)
 
@@ -281,6 +489,21 @@ class FileProducer(BaseProducer):
             filename_list = map(filename_list.__getitem__, num_file_list)
             label_list = map(label_list.__getitem__, num_file_list)
 
+        return (filename_list, label_list)
+
+    def _blob(self,
+              image_dir,
+              num_inputs=1,
+              subsample_divisible=True,
+              check=False,
+              shuffle=False,
+              decode_size=None,
+              class_limits=None):
+
+        (filename_list, label_list) = self.list_files(image_dir, subsample_divisible=subsample_divisible, check=check, class_limits=class_limits)
+        if subsample_divisible:
+            self.num_test_images = len(filename_list)
+
         images = list()
         labels = list()
         for num_input in xrange(num_inputs):
@@ -291,7 +514,7 @@ class FileProducer(BaseProducer):
 
             filename_queue = self.get_queue_enqueue(filename_list, dtype=tf.string, shape=(), auto=True)[0]
             (key, value) = tf.WholeFileReader().read(filename_queue)
-            image = tf.to_float(tf.image.decode_jpeg(value))
+            image = ImageUtil.decode_jpeg(value, size=decode_size)
 
             label_queue = self.get_queue_enqueue(label_list, dtype=tf.int64, shape=(), auto=True)[0]
             label = label_queue.dequeue()
@@ -301,26 +524,220 @@ class FileProducer(BaseProducer):
 
         return Blob(images=images, labels=labels)
 
-    def trainBlob(self, image_dir, check=True):
+    def trainBlob(self, image_dir, check=True, decode_size=None, class_limits=None):
         return self._blob(
             image_dir,
             num_inputs=self.num_train_inputs,
             subsample_divisible=False,
             check=check,
-            shuffle=True)
+            shuffle=True,
+            decode_size=decode_size,
+            class_limits=class_limits)
 
-    def testBlob(self, image_dir, check=False):
+    def testBlob(self, image_dir, check=False, decode_size=None):
         return self._blob(
             image_dir,
             num_inputs=self.num_test_inputs,
             subsample_divisible=True,
             check=check,
-            shuffle=False)
+            shuffle=False,
+            decode_size=decode_size)
+
+    def sampledBlob(self, image_dir, sampler, check=True, decode_size=None):
+        (filename_list, label_list) = self.list_files(image_dir, subsample_divisible=False, check=check)
+        sampler.build(filename_list, label_list)
+
+        images = list()
+        labels = list()
+        weights = list()
+        for num_input in xrange(self.num_train_inputs):
+            (index, filename, weight) = sampler.queue.dequeue()
+            image = ImageUtil.decode_jpeg(tf.read_file(filename), size=decode_size)
+
+            images.append(image)
+            labels.append(index)
+            weights.append(weight)
+
+        return Blob(images=images, labels=labels, weights=weights)
 
     def kwargs(self):
         return dict()
 
 
+class ManifestProducer(BaseProducer):
+    CAPACITY = 4096
+    NUM_INPUTS = 8
+    FAILED_INDEX = -2
+
+    def __init__(self,
+                 capacity=CAPACITY,
+                 num_inputs=NUM_INPUTS):
+
+        self.capacity = capacity
+        self.num_inputs = num_inputs
+
+    def blob(self, decode_size=None):
+        self.indices = tf.placeholder(name='indices', shape=(None,), dtype=tf.int64)
+        self.filenames = tf.placeholder(name='filenames', shape=(None,), dtype=tf.string)
+        self.queue = tf.FIFOQueue(self.capacity, dtypes=[tf.int64, tf.string], shapes=[(), ()])
+        self.enqueue = self.queue.enqueue_many([self.indices, self.filenames])
+
+        images = list()
+        labels = list()
+        for num_input in xrange(self.num_inputs):
+            (index, filename) = self.queue.dequeue()
+            (image, is_valid) = ImageUtil.read_decode_jpeg(filename, size=decode_size)
+
+            images.append(image)
+            labels.append(tf.select(is_valid, index, ManifestProducer.FAILED_INDEX - index))
+
+        return Blob(images=images, labels=labels)
+
+    @staticmethod
+    def is_failed(indices):
+        return indices <= ManifestProducer.FAILED_INDEX
+
+    @staticmethod
+    def failed_index(indices):
+        return ManifestProducer.FAILED_INDEX - indices
+
+    def kwargs(self, indices, filenames):
+        return dict(
+            feed_dict={self.indices: indices, self.filenames: filenames},
+            fetch=dict(manifest_producer_enqueue=self.enqueue))
+
+
+class SumTree(object):
+    def __init__(self, values):
+        self.size = len(values)
+        self.capacity = 1 << int(np.ceil(np.log2(max(self.size, 1))))
+        self.sums = np.zeros(2 * self.capacity, dtype=np.float64)
+        self.mins = np.full(2 * self.capacity, np.inf, dtype=np.float64)
+        self.sums[self.capacity:self.capacity + self.size] = values
+        self.mins[self.capacity:self.capacity + self.size] = values
+
+        begin = self.capacity / 2
+        while begin >= 1:
+            self.refresh(np.arange(begin, 2 * begin))
+            begin /= 2
+
+    @property
+    def total(self):
+        return self.sums[1]
+
+    @property
+    def min(self):
+        return self.mins[1]
+
+    def refresh(self, nodes):
+        self.sums[nodes] = self.sums[2 * nodes] + self.sums[2 * nodes + 1]
+        self.mins[nodes] = np.minimum(self.mins[2 * nodes], self.mins[2 * nodes + 1])
+
+    def get(self, indices):
+        return self.sums[self.capacity + indices]
+
+    def update(self, indices, values):
+        nodes = self.capacity + np.asarray(indices)
+        self.sums[nodes] = values
+        self.mins[nodes] = values
+
+        nodes = np.unique(nodes / 2)
+        while nodes[0] >= 1:
+            self.refresh(nodes)
+            nodes = np.unique(nodes / 2)
+
+    def sample(self, size):
+        targets = np.random.uniform(0, self.total, size=size)
+        nodes = np.ones(size, dtype=np.int64)
+        while nodes[0] < self.capacity:
+            lefts = 2 * nodes
+            is_right = targets >= self.sums[lefts]
+            targets -= np.where(is_right, self.sums[lefts], 0)
+            nodes = lefts + is_right
+        return np.minimum(nodes - self.capacity, self.size - 1)
+
+
+class PrioritySampler(object):
+    CAPACITY = 4096
+    FEED_SIZE = 1024
+    LOSS_POWER = 0.6
+    CLASS_POWER = 0.5
+    WEIGHT_POWER = 0.4
+    DECAY = 0.5
+    MIN_LOSS = 0.05
+
+    def __init__(self,
+                 capacity=CAPACITY,
+                 feed_size=FEED_SIZE,
+                 loss_power=LOSS_POWER,
+                 class_power=CLASS_POWER,
+                 weight_power=WEIGHT_POWER,
+                 decay=DECAY,
+                 min_loss=MIN_LOSS):
+
+        self.capacity = capacity
+        self.feed_size = feed_size
+        self.loss_power = loss_power
+        self.class_power = class_power
+        self.weight_power = weight_power
+        self.decay = decay
+        self.min_loss = min_loss
+
+    def build(self, filename_list, label_list):
+        self.filename_list = np.array(filename_list)
+        self.label_list = np.array(label_list, dtype=np.int64)
+        self.losses = np.full(len(filename_list), np.log(len(META.class_names)), dtype=np.float32)
+        self.class_priorities = np.bincount(self.label_list, minlength=len(META.class_names)).astype(np.float32) ** - self.class_power
+        self.tree = SumTree(self.get_priorities(np.arange(len(filename_list))))
+        self.lock = threading.Lock()
+
+        self.indices = tf.placeholder(name='sampler_indices', shape=(None,), dtype=tf.int64)
+        self.filenames = tf.placeholder(name='sampler_filenames', shape=(None,), dtype=tf.string)
+        self.weights = tf.placeholder(name='sampler_weights', shape=(None,), dtype=tf.float32)
+        self.queue = tf.FIFOQueue(self.capacity, dtypes=[tf.int64, tf.string, tf.float32], shapes=[(), (), ()])
+        self.enqueue = self.queue.enqueue_many([self.indices, self.filenames, self.weights])
+
+        self.labels = tf.constant(self.label_list, dtype=tf.int64)
+
+    def get_priorities(self, indices):
+        return np.maximum(self.losses[indices], self.min_loss) ** self.loss_power * self.class_priorities[self.label_list[indices]]
+
+    def get_weights(self, priorities):
+        # (N * p) ** -weight_power over its maximum, which belongs to the smallest priority
+        return ((priorities / self.tree.min) ** - self.weight_power).astype(np.float32)
+
+    def lookup(self, blob):
+        (_, self.index, self.weight) = blob.as_tuple_list()[0]
+        self.label = tf.gather(self.labels, self.index)
+        return Blob(images=blob.images[0], labels=self.label)
+
+    def update(self, indices, losses):
+        with self.lock:
+            self.losses[indices] = self.decay * self.losses[indices] + (1 - self.decay) * losses
+            self.tree.update(indices, self.get_priorities(indices))
+
+    def feed(self, sess):
+        def loop():
+            while True:
+                with self.lock:
+                    indices = self.tree.sample(self.feed_size)
+                    weights = self.get_weights(self.tree.get(indices))
+                sess.run(self.enqueue, feed_dict={
+                    self.indices: indices,
+                    self.filenames: self.filename_list[indices],
+                    self.weights: weights})
+
+        thread = threading.Thread(target=loop)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def callback(self, loss):
+        return dict(
+            fetch=dict(sampler_index=self.index, sampler_loss=loss),
+            func=lambda **kwargs: self.update(kwargs['sampler_index'], kwargs['sampler_loss']))
+
+
 class Preprocess(object):
     NUM_TEST_CROPS = 4
     TRAIN_SIZE_RANGE = (224, 320)
@@ -338,12 +755,14 @@ class Preprocess(object):
                  max_log_aspect_ratio=MAX_LOG_ASPECT_RATIO,
                  net_size=NET_SIZE,
                  net_channel=NET_CHANNEL,
-                 mean_path=MEAN_PATH):
+                 mean_path=MEAN_PATH,
+                 schedule=None):
 
         self.num_test_crops = num_test_crops
         self.train_size_range = train_size_range
         self.test_size_range = test_size_range
         self.max_log_aspect_ratio = max_log_aspect_ratio
+        self.train_decode_size = int(np.ceil(train_size_range[1] * np.exp(max_log_aspect_ratio)))
 
         self.net_size = net_size
         self.net_channel = net_channel
@@ -351,31 +770,52 @@ class Preprocess(object):
 
         self.mean_path = mean_path
         self.mean = scipy.io.loadmat(mean_path)['mean']
+        self.schedule = schedule
+        if schedule is not None:
+            assert all(net_size / 2 <= stage['net_size'] <= net_size for stage in schedule.stages), 'Schedule sizes must be between half and all of net_size!'
 
-    def _train(self, image):
-        image = ImageUtil.random_resize(image, size_range=self.train_size_range, max_log_aspect_ratio=self.max_log_aspect_ratio)
-        image = ImageUtil.random_crop(image, size=self.net_size)
+    def _train(self, image, net_size=None):
+        if self.schedule is None:
+            (size_range, net_size) = (self.train_size_range, self.net_size)
+        else:
+            size_range = self.schedule.size_range
+
+        image = ImageUtil.random_resize(image, size_range=size_range, max_log_aspect_ratio=self.max_log_aspect_ratio)
+        image = ImageUtil.random_crop(image, size=net_size)
         image = ImageUtil.random_flip(image)
         image = ImageUtil.random_adjust_rgb(image)
-        image = image - self.mean
+        image = ImageUtil.to_uint8(image)
+        if self.schedule is not None:
+            image = self.pad(image, net_size)
         image.set_shape(self.shape)
 
         return image
 
+    def pad(self, image, size):
+        padding = tf.pack([0, self.net_size - size])
+        image = tf.pad(image, tf.pack([padding, padding, tf.constant([0, 0])]), mode='SYMMETRIC')
+        return image
+
     def train(self, blob):
-        return Blob(images=map(self._train, blob.images), labels=blob.labels)
+        if self.schedule is None:
+            return Blob(images=map(self._train, blob.images), labels=blob.labels, **blob.extras())
+
+        # Each crop records the stage size it was made at, so Batch.train can drop stale ones
+        net_sizes = [tf.identity(self.schedule.net_size) for _ in blob.images]
+        images = [self._train(image, net_size=net_size) for (image, net_size) in zip(blob.images, net_sizes)]
+        return Blob(images=images, labels=blob.labels, sizes=net_sizes, **blob.extras())
 
     def _test_map(self, image):
         image = ImageUtil.random_resize(image, size_range=self.test_size_range, max_log_aspect_ratio=0.0)
         image = ImageUtil.random_crop(image, size=self.net_size)
         image = ImageUtil.random_flip(image)
-        image = image - self.mean
+        image = ImageUtil.to_uint8(image)
 
         return image
 
     def _test(self, image):
         image = tf.tile(tf.expand_dims(image, dim=0), multiples=(self.num_test_crops, 1, 1, 1))
-        image = tf.map_fn(self._test_map, image)
+        image = tf.map_fn(self._test_map, image, dtype=tf.uint8)
         image.set_shape((self.num_test_crops,) + self.shape)
 
         return image
@@ -383,6 +823,14 @@ class Preprocess(object):
     def test(self, blob):
         return Blob(images=map(self._test, blob.images), labels=blob.labels)
 
+    def _normalize(self, image):
+        image = tf.to_float(image) - self.mean
+
+        return image
+
+    def normalize(self, blob):
+        return Blob(images=map(self._normalize, blob.images), labels=blob.labels)
+
 
 class Batch(object):
     BATCH_SIZE = 64
@@ -396,16 +844,18 @@ class Batch(object):
                  num_test_crops=NUM_TEST_CROPS,
                  train_capacity=TRAIN_CAPACITY,
                  test_capacity=TEST_CAPACITY,
-                 min_after_dequeue=MIN_AFTER_DEQUEUE):
+                 min_after_dequeue=MIN_AFTER_DEQUEUE,
+                 schedule=None):
 
         self.batch_size = batch_size
         self.num_test_crops = num_test_crops
         self.train_capacity = train_capacity
         self.test_capacity = test_capacity
         self.min_after_dequeue = min_after_dequeue
+        self.schedule = schedule
 
     def make_size(self, batch_size):
-        batch_size = tf.constant(batch_size, dtype=tf.int32)
+        batch_size = tf.convert_to_tensor(batch_size, dtype=tf.int32)
         zero = tf.constant(0, dtype=tf.int32)
 
         total_size = tf.Variable(-1, trainable=False, dtype=tf.int32)
@@ -425,16 +875,49 @@ class Batch(object):
         return (batch_size_, total_size_, assign)
 
     def train(self, blob):
-        (self.train_batch_size, self.train_total_size, self.train_assign) = self.make_size(self.batch_size)
+        if self.schedule is None:
+            batch_size = self.batch_size
+        else:
+            batch_size = self.schedule.batch_size
+        (self.train_batch_size, self.train_total_size, self.train_assign) = self.make_size(batch_size)
+
+        tuple_list = blob.as_tuple_list()
+        self.train_queue = tf.RandomShuffleQueue(
+            self.train_capacity,
+            min_after_dequeue=self.min_after_dequeue,
+            dtypes=[value.dtype for value in tuple_list[0]],
+            shapes=[value.get_shape() for value in tuple_list[0]])
+        queue_runner = tf.train.QueueRunner(self.train_queue, [self.train_queue.enqueue(values) for values in tuple_list])
+        tf.train.add_queue_runner(queue_runner)
+        self.train_fill = tf.to_float(self.train_queue.size()) / self.train_capacity
 
-        (image, label) = tf.tuple(
-            tf.train.shuffle_batch_join(
-                blob.as_tuple_list(),
-                batch_size=self.train_batch_size,
-                capacity=self.train_capacity,
-                min_after_dequeue=self.min_after_dequeue),
+        values = tf.tuple(
+            self.train_queue.dequeue_many(self.train_batch_size),
             control_inputs=[self.train_assign])
-        return Blob(images=image, labels=label)
+        (image, label) = values[:2]
+        extras = dict(zip(blob.extra_fields(), values[2:]))
+        if self.schedule is not None:
+            # Crops made before a stage grew would be sliced into their mirrored padding
+            net_size = tf.identity(self.schedule.net_size)
+            is_fresh = tf.greater_equal(extras.pop('sizes'), net_size)
+            (image, label) = (tf.boolean_mask(image, is_fresh), tf.boolean_mask(label, is_fresh))
+            extras = {field: tf.boolean_mask(value, is_fresh) for (field, value) in extras.iteritems()}
+
+            image = tf.slice(image, (0, 0, 0, 0), tf.pack([-1, net_size, net_size, -1]))
+            image.set_shape((None, None, None, ImageUtil.get_channel(image)))
+
+            drain_sizes = self.train_queue.dequeue_many(self.batch_size)[2 + blob.extra_fields().index('sizes')]
+            self.train_drain = tf.reduce_sum(tf.to_int32(tf.less(drain_sizes, net_size)))
+            self.schedule.drains.append(self.drain)
+
+        return Blob(images=image, labels=label, **extras)
+
+    def drain(self, sess):
+        # Throw away shuffled batches until one holds no crop from before the stage grew
+        num_batches = 1
+        while sess.run(self.train_drain) > 0:
+            num_batches += 1
+        print('Drained %d batches of stale crops from the shuffle buffer' % num_batches)
 
     def test(self, blob):
         (self.test_batch_size, self.test_total_size, self.test_assign) = self.make_size(self.batch_size / self.num_test_crops)
@@ -462,6 +945,56 @@ class Batch(object):
                 fetch=dict(batch_test_assign=self.test_assign))
 
 
+class Schedule(object):
+    SIZES = (128, 160, 192, 224)
+    SIZE_RANGE_RATIO = float(Preprocess.TRAIN_SIZE_RANGE[1]) / Preprocess.TRAIN_SIZE_RANGE[0]
+
+    @staticmethod
+    def progressive(iteration, sizes=SIZES, batch_size=Batch.BATCH_SIZE, is_scale_batch=False, size_range_ratio=SIZE_RANGE_RATIO):
+        stages = list()
+        for (num_stage, size) in enumerate(sizes):
+            stage = dict(
+                step=num_stage * iteration / len(sizes),
+                net_size=size,
+                size_range=(size, int(size * size_range_ratio)))
+            if is_scale_batch:
+                stage['batch_size'] = int(batch_size * (float(sizes[-1]) / size) ** 2) / 8 * 8
+            stages.append(stage)
+        return Schedule(stages, batch_size=batch_size)
+
+    def __init__(self, stages, batch_size=Batch.BATCH_SIZE):
+        self.stages = sorted(stages, key=lambda stage: stage['step'])
+        self.default_batch_size = batch_size
+        self.stage = None
+        self.drains = list()
+
+        stage = self.stages[0]
+        (self.net_size_, self.net_size, self.net_size_assign) = Net.get_assignable_variable(stage['net_size'], 'schedule_net_size', dtype=tf.int32)
+        (self.size_range_, self.size_range, self.size_range_assign) = Net.get_assignable_variable(stage['size_range'], 'schedule_size_range', shape=(2,))
+        (self.batch_size_, self.batch_size, self.batch_size_assign) = Net.get_assignable_variable(stage.get('batch_size', batch_size), 'schedule_batch_size', dtype=tf.int32)
+
+    def update(self, sess, step):
+        stage = [stage for stage in self.stages if stage['step'] <= step][-1]
+        if stage is self.stage:
+            return
+
+        # The variables start at the first stage, which is what the queues were filled with
+        is_grown = stage['net_size'] > (self.stages[0] if self.stage is None else self.stage)['net_size']
+        self.stage = stage
+        batch_size = stage.get('batch_size', self.default_batch_size)
+        sess.run(
+            [self.net_size_assign, self.size_range_assign, self.batch_size_assign],
+            feed_dict={
+                self.net_size_: stage['net_size'],
+                self.size_range_: stage['size_range'],
+                self.batch_size_: batch_size})
+        print('Schedule at step %d: net_size=%d, size_range=%s, batch_size=%d' % (step, stage['net_size'], stage['size_range'], batch_size))
+
+        if is_grown:
+            for drain in self.drains:
+                drain(sess)
+
+
 class Net(object):
     class Phase(enum.Enum):
         NONE = 0
@@ -471,14 +1004,21 @@ class Net(object):
     NET_VARIABLES = 'net_variables'
     NET_COLLECTIONS = [tf.GraphKeys.VARIABLES, NET_VARIABLES]
     MODEL_FILENAME = 'model'
+    PROFILE_FILENAME = 'profile.json'
+    PROFILE_PER = 100
+    SHOW_ATTRS = ['loss', 'acc']
+    SHOW_DECAY = 0.99
 
     LEARNING_RATE = 1e-1
     LEARNING_RATE_MODES = dict(normal=1.0, slow=0.0)
     LEARNING_RATE_DECAY_STEPS = 0
     LEARNING_RATE_DECAY_RATE = 1.0
     WEIGHT_DECAY = 0.0
+    NUM_ACCUM_STEPS = 1
 
     GPU_FRAC = 1.0
+    NUM_INTRA_THREADS = 0
+    NUM_INTER_THREADS = 0
 
     @staticmethod
     def placeholder(name=None, shape=(), dtype=tf.float32, default=None):
@@ -522,6 +1062,12 @@ class Net(object):
             value = tf.nn.avg_pool(value, ksize=Net.expand(size), strides=Net.expand(stride), padding=padding, name='avg_pool')
         return value
 
+    @staticmethod
+    def global_avg_pool(value, name):
+        with tf.variable_scope(name):
+            value = tf.reduce_mean(value, reduction_indices=(1, 2), keep_dims=True, name='avg_pool')
+        return value
+
     @staticmethod
     def max_pool(value, name, size, stride=None, padding='SAME'):
         with tf.variable_scope(name):
@@ -536,22 +1082,38 @@ class Net(object):
                  learning_rate_decay_steps=LEARNING_RATE_DECAY_STEPS,
                  learning_rate_decay_rate=LEARNING_RATE_DECAY_RATE,
                  weight_decay=WEIGHT_DECAY,
+                 num_accum_steps=NUM_ACCUM_STEPS,
                  gpu_frac=GPU_FRAC,
+                 num_intra_threads=NUM_INTRA_THREADS,
+                 num_inter_threads=NUM_INTER_THREADS,
+                 working_dir=None,
+                 net_collection=NET_VARIABLES,
                  is_train=False,
-                 is_show=False):
+                 is_show=False,
+                 is_profile=False):
         assert len(META.class_names), 'Only create net when META.class_names is not empty!'
 
         self.learning_rate = Net.get_const_variable(learning_rate, 'learning_rate')
         self.learning_modes = learning_modes
         self.weight_decay = weight_decay
+        self.num_accum_steps = num_accum_steps
         self.gpu_frac = gpu_frac
+        self.num_intra_threads = num_intra_threads
+        self.num_inter_threads = num_inter_threads
         self.is_train = is_train
         self.is_show = is_show
+        self.profiler = Profiler(is_enabled=is_profile)
+        self.working_dir = META.working_dir if working_dir is None else working_dir
+        self.net_collection = net_collection
+        self.net_collections = [tf.GraphKeys.VARIABLES, net_collection]
+        self.phase_attrs = dict()
+        self.example_weight = None
+        self.allow_missing = ()
 
         (self.phase, self.phase_, self.phase_assign) = Net.get_assignable_variable(Net.Phase.NONE.value, 'phase', dtype=tf.int32)
-        self.class_names = Net.get_const_variable(META.class_names, 'class_names', shape=(len(META.class_names),), dtype=tf.string, collections=Net.NET_COLLECTIONS)
+        self.class_names = Net.get_const_variable(META.class_names, 'class_names', shape=(len(META.class_names),), dtype=tf.string, collections=self.net_collections)
         self.global_step = Net.get_const_variable(0, 'global_step')
-        self.model_path = os.path.join(META.working_dir, Net.MODEL_FILENAME)
+        self.model_path = os.path.join(self.working_dir, Net.MODEL_FILENAME)
 
         if (learning_rate_decay_steps > 0) and (learning_rate_decay_rate < 1.0):
             self.learning_rate = tf.train.exponential_decay(
@@ -574,7 +1136,11 @@ class Net(object):
 
         self.target = tf.one_hot(self.label, len(META.class_names))
         self.target_frac = tf.reduce_mean(self.target, 0)
-        self.loss = - tf.reduce_mean(self.target * tf.log(self.prob + util.EPSILON)) * len(META.class_names)
+        self.example_loss = - tf.reduce_sum(self.target * tf.log(self.prob + util.EPSILON), 1)
+        if self.example_weight is None:
+            self.loss = tf.reduce_mean(self.example_loss)
+        else:
+            self.loss = tf.reduce_mean(self.example_weight * self.example_loss)
         regularization_losses = tf.get_collection(tf.GraphKeys.REGULARIZATION_LOSSES)
         if regularization_losses:
             self.loss += tf.add_n(regularization_losses)
@@ -585,14 +1151,82 @@ class Net(object):
         self.acc = tf.reduce_mean(self.correct)
 
     def make_train_op(self):
+        if self.num_accum_steps > 1:
+            self.make_accum_train_op()
+            return
+
         train_ops = []
-        for (learning_mode, learning_rate_relative) in Net.LEARNING_RATE_MODES.iteritems():
+        for (learning_mode, learning_rate_relative) in self.learning_modes.iteritems():
             variables = tf.get_collection(learning_mode)
             if variables:
                 train_ops.append(tf.train.AdamOptimizer(
                     learning_rate=self.learning_rate * learning_rate_relative,
-                    epsilon=1.0).minimize(self.loss, global_step=self.global_step))
-        self.train_op = tf.group(*train_ops)
+                    epsilon=1.0).minimize(self.loss, var_list=variables))
+        with tf.control_dependencies(train_ops):
+            self.train_op = self.global_step.assign_add(1)
+
+    def make_accum_train_op(self):
+        num_accum_steps = self.num_accum_steps
+
+        def get_accum_variable(name, shape=(), dtype=tf.float32):
+            return tf.Variable(tf.zeros(shape, dtype=dtype), trainable=False, name=name)
+
+        (optimizers, grads_and_accums) = (list(), list())
+        for (learning_mode, learning_rate_relative) in self.learning_modes.iteritems():
+            variables = tf.get_collection(learning_mode)
+            if variables:
+                optimizer = tf.train.AdamOptimizer(
+                    learning_rate=self.learning_rate * learning_rate_relative,
+                    epsilon=1.0)
+                grads_and_vars = [(grad, var) for (grad, var) in optimizer.compute_gradients(self.loss, var_list=variables) if grad is not None]
+                accums = [get_accum_variable('%s_accum' % var.op.name, shape=var.get_shape()) for (_, var) in grads_and_vars]
+
+                # Create the optimizer slots here, outside the tf.cond below
+                optimizer.apply_gradients([(accum, var) for (accum, (_, var)) in zip(accums, grads_and_vars)])
+                optimizers.append(optimizer)
+                grads_and_accums.append([(grad, var, accum) for (accum, (grad, var)) in zip(accums, grads_and_vars)])
+
+        # Shown attributes are summed per micro-batch, and their mean and moving average are only
+        # written when the effective batch completes; the cond outputs carry them to the display
+        attr_accums = [get_accum_variable('%s_accum' % attr) for attr in self.SHOW_ATTRS]
+        attr_means = [get_accum_variable('%s_mean' % attr) for attr in self.SHOW_ATTRS]
+        attr_avgs = [get_accum_variable('%s_avg' % attr) for attr in self.SHOW_ATTRS]
+        accum_step = get_accum_variable('accum_step', dtype=tf.int32)
+
+        accums_ = [[(accum.assign_add(grad), var, accum) for (grad, var, accum) in values] for values in grads_and_accums]
+        attr_accums_ = [accum.assign_add(getattr(self, attr)) for (attr, accum) in zip(self.SHOW_ATTRS, attr_accums)]
+        accum_step_ = accum_step.assign_add(1)
+
+        def apply():
+            apply_ops = [
+                optimizer.apply_gradients([(accum_ / num_accum_steps, var) for (accum_, var, _) in values])
+                for (optimizer, values) in zip(optimizers, accums_)]
+
+            num_updates = tf.to_float(self.global_step)
+            decay = tf.minimum(Net.SHOW_DECAY, (1 + num_updates) / (10 + num_updates))
+            means_ = [mean.assign(accum_ / num_accum_steps) for (mean, accum_) in zip(attr_means, attr_accums_)]
+            avgs_ = [avg.assign(decay * avg + (1 - decay) * mean_) for (avg, mean_) in zip(attr_avgs, means_)]
+
+            with tf.control_dependencies(apply_ops + avgs_):
+                reset_ops = [accum.assign(tf.zeros_like(accum)) for values in accums_ for (_, _, accum) in values]
+                reset_ops.extend([accum.assign(0.0) for accum in attr_accums])
+                reset_ops.append(accum_step.assign(0))
+
+            with tf.control_dependencies(reset_ops):
+                return [self.global_step.assign_add(1)] + [tf.identity(value) for value in means_ + avgs_]
+
+        def skip():
+            return [tf.identity(self.global_step)] + [tf.identity(value) for value in attr_means + attr_avgs]
+
+        with tf.control_dependencies([accum_ for values in accums_ for (accum_, _, _) in values] + attr_accums_):
+            is_apply = tf.equal(accum_step_, num_accum_steps)
+        outputs = tf.cond(is_apply, apply, skip)
+
+        num_attrs = len(self.SHOW_ATTRS)
+        self.train_op = outputs[0]
+        self.phase_attrs[Net.Phase.TRAIN] = {
+            attr: dict(raw=raw, avg=avg)
+            for (attr, raw, avg) in zip(self.SHOW_ATTRS, outputs[1:1 + num_attrs], outputs[1 + num_attrs:])}
 
     def make_show(self):
         def identity(value):
@@ -606,11 +1240,17 @@ class Net(object):
                 'raw': identity,
                 'avg': lambda value: util.exponential_moving_average(value, num_updates=self.global_step)}}
 
+        def get_show(phase, attr, postfix, func):
+            values = self.phase_attrs.get(phase, dict()).get(attr)
+            if values is None:
+                return func(getattr(self, attr))
+            return values[postfix]
+
         self.show_dict = {
             phase: {
-                '%s_%s_%s' % (phase.name, attr, postfix): func(getattr(self, attr))
+                '%s_%s_%s' % (phase.name, attr, postfix): get_show(phase, attr, postfix, func)
                 for (postfix, func) in postfix_funcs[phase].iteritems()
-                for attr in ['loss', 'acc']}
+                for attr in self.SHOW_ATTRS}
             for phase in [Net.Phase.TRAIN, Net.Phase.TEST]}
 
         self.show_dict[Net.Phase.TRAIN].update({
@@ -620,19 +1260,68 @@ class Net(object):
             phase: tf.merge_summary([tf.scalar_summary(name, attr) for (name, attr) in self.show_dict[phase].iteritems()])
             for phase in [Net.Phase.TRAIN, Net.Phase.TEST]}
 
-    def finalize(self):
-        self.sess = tf.InteractiveSession(config=tf.ConfigProto(
+    def get_session_config(self):
+        return tf.ConfigProto(
             allow_soft_placement=True,
-            gpu_options=tf.GPUOptions(per_process_gpu_memory_fraction=self.gpu_frac)))
-        self.saver = tf.train.Saver(tf.get_collection(Net.NET_VARIABLES))
+            intra_op_parallelism_threads=self.num_intra_threads,
+            inter_op_parallelism_threads=self.num_inter_threads,
+            gpu_options=tf.GPUOptions(per_process_gpu_memory_fraction=self.gpu_frac))
+
+    def finalize(self):
+        self.sess = tf.InteractiveSession(config=self.get_session_config())
+        self.saver = tf.train.Saver(tf.get_collection(self.net_collection))
         self.summary_writer = tf.train.SummaryWriter(META.working_dir)
 
         self.sess.run(tf.initialize_all_variables())
         if os.path.isfile(self.model_path):
-            print('Model restored from %s' % self.model_path)
-            self.saver.restore(tf.get_default_session(), self.model_path)
+            self.restore()
         self.model = Model(self.global_step)
 
+    def restore(self):
+        reader = tf.train.NewCheckpointReader(self.model_path)
+        shapes = reader.get_variable_to_shape_map()
+        variables = tf.get_collection(self.net_collection)
+        missing = [var.op.name for var in variables if var.op.name not in shapes]
+        unexpected = [name for name in missing if not name.startswith(self.allow_missing)]
+        if unexpected:
+            raise ValueError('%s missing from %s!' % (', '.join(unexpected), self.model_path))
+        if missing:
+            print('Not in %s, keeping initial values: %s' % (self.model_path, ', '.join(missing)))
+
+        variables = [var for var in variables if var.op.name in shapes]
+        resized = [var for var in variables if var.get_shape().as_list() != shapes[var.op.name]]
+        tf.train.Saver([var for var in variables if var not in resized]).restore(self.sess, self.model_path)
+        print('Model restored from %s' % self.model_path)
+
+        if resized:
+            self.restore_widened(reader, resized)
+
+    def restore_widened(self, reader, variables):
+        class_names = list(META.class_names)
+        old_class_names = list(reader.get_tensor(self.class_names.op.name))
+        missing = set(old_class_names) - set(class_names)
+        if missing:
+            raise ValueError('Classes %s in %s are missing from META.class_names!' % (', '.join(sorted(missing)), self.model_path))
+        indices = map(class_names.index, old_class_names)
+
+        for var in variables:
+            if var is self.class_names:
+                continue
+
+            value = self.sess.run(var)
+            old_value = reader.get_tensor(var.op.name)
+            if (value.shape[:-1] != old_value.shape[:-1]) or (old_value.shape[-1] != len(old_class_names)):
+                raise ValueError('%s has shape %s in %s, cannot widen to %s!' % (var.op.name, old_value.shape, self.model_path, value.shape))
+
+            value[..., indices] = old_value
+            self.sess.run(var.assign(value))
+            print('%s widened from %d to %d classes' % (var.op.name, len(old_class_names), len(class_names)))
+
+    def export_profile(self):
+        global_step = self.sess.run(self.global_step)
+        self.summary_writer.add_summary(self.profiler.summary(), global_step)
+        self.profiler.save(os.path.join(self.working_dir, Net.PROFILE_FILENAME))
+
     def start(self, default_phase=Phase.NONE):
         self.sess.run(self.phase_assign, feed_dict={self.phase: default_phase.value})
         tf.train.start_queue_runners()
@@ -649,11 +1338,18 @@ class ResNet(Net):
                  learning_rate_decay_steps=Net.LEARNING_RATE_DECAY_STEPS,
                  learning_rate_decay_rate=Net.LEARNING_RATE_DECAY_RATE,
                  weight_decay=Net.WEIGHT_DECAY,
+                 num_accum_steps=Net.NUM_ACCUM_STEPS,
                  gpu_frac=Net.GPU_FRAC,
+                 num_intra_threads=Net.NUM_INTRA_THREADS,
+                 num_inter_threads=Net.NUM_INTER_THREADS,
+                 working_dir=None,
+                 net_collection=Net.NET_VARIABLES,
                  resnet_params_path=RESNET_PARAMS_PATH,
                  num_test_crops=NUM_TEST_CROPS,
+                 channels=None,
                  is_train=False,
-                 is_show=False):
+                 is_show=False,
+                 is_profile=False):
 
         super(ResNet, self).__init__(
             learning_rate=learning_rate,
@@ -661,18 +1357,35 @@ class ResNet(Net):
             learning_rate_decay_steps=learning_rate_decay_steps,
             learning_rate_decay_rate=learning_rate_decay_rate,
             weight_decay=weight_decay,
+            num_accum_steps=num_accum_steps,
             gpu_frac=gpu_frac,
+            num_intra_threads=num_intra_threads,
+            num_inter_threads=num_inter_threads,
+            working_dir=working_dir,
+            net_collection=net_collection,
             is_train=is_train,
-            is_show=is_show)
+            is_show=is_show,
+            is_profile=is_profile)
 
         self.resnet_params_path = resnet_params_path
         self.num_test_crops = num_test_crops
+        if channels is None:
+            channels_path = os.path.join(self.working_dir, Pruning.CHANNELS_FILENAME)
+            channels = Pruning.load_channels(channels_path) if os.path.isfile(channels_path) else dict()
+            if channels:
+                print('Pruned channels loaded from %s' % channels_path)
+        self.channels = channels
+        self.batch_norm_decay = None
+        self.flops = 0
         if not os.path.isfile(self.model_path):
-            self.resnet_params = scipy.io.loadmat(resnet_params_path)
+            if resnet_params_path is None:
+                self.resnet_params = dict()
+            else:
+                self.resnet_params = scipy.io.loadmat(resnet_params_path)
 
     def get_initializer(self, name, index, is_vector, default):
         if os.path.isfile(self.model_path):
-            return None
+            return default
         elif name in self.resnet_params:
             print('%s initialized from ResNet' % name)
             if is_vector:
@@ -683,14 +1396,32 @@ class ResNet(Net):
         else:
             return default
 
+    def batch_moments(self, value, mean, variance):
+        # Normalize with batch statistics while training and with their moving averages otherwise
+        def train():
+            (batch_mean, batch_variance) = tf.nn.moments(value, (0, 1, 2))
+            decay = self.batch_norm_decay
+            with tf.control_dependencies([
+                    mean.assign_sub((1 - decay) * (mean - batch_mean)),
+                    variance.assign_sub((1 - decay) * (variance - batch_variance))]):
+                return (tf.identity(batch_mean), tf.identity(batch_variance))
+
+        shape = ImageUtil.get_shape(mean)
+        return self.case([
+                (Net.Phase.TEST, lambda: (tf.identity(mean), tf.identity(variance))),
+                (Net.Phase.TRAIN, train)
+            ],
+            shapes=[shape, shape],
+        )
+
     def conv(self, value, conv_name, out_channel, size=(1, 1), stride=(1, 1), padding='SAME', biased=False, norm_name=None, activation_fn=None, learning_mode='normal'):
         in_channel = ImageUtil.get_channel(value)
 
         if self.learning_modes[learning_mode] > 0:
-            collections = Net.NET_COLLECTIONS + [learning_mode]
+            collections = self.net_collections + [learning_mode]
             trainable = True
         else:
-            collections = Net.NET_COLLECTIONS
+            collections = self.net_collections
             trainable = False
 
         weights_initializer = self.get_initializer(
@@ -714,6 +1445,9 @@ class ResNet(Net):
                 collections=collections)
 
         value = tf.nn.conv2d(value, weight, strides=Net.expand(stride), padding=padding)
+        (height, width) = ImageUtil.get_size(value)
+        if (height is not None) and (width is not None):
+            self.flops += 2 * height * width * size[0] * size[1] * in_channel * out_channel
 
         if biased:
             bias_initializer = self.get_initializer(
@@ -754,13 +1488,13 @@ class ResNet(Net):
                     shape=(out_channel,),
                     initializer=mean_initializer,
                     trainable=False,
-                    collections=Net.NET_COLLECTIONS)
+                    collections=self.net_collections)
                 variance = tf.get_variable(
                     'variance',
                     shape=(out_channel,),
                     initializer=variance_initializer,
                     trainable=False,
-                    collections=Net.NET_COLLECTIONS)
+                    collections=self.net_collections)
 
             scale_initializer = self.get_initializer(
                 scale_name,
@@ -788,6 +1522,9 @@ class ResNet(Net):
                     trainable=trainable,
                     collections=collections)
 
+            if self.batch_norm_decay is not None:
+                (mean, variance) = self.batch_moments(value, mean, variance)
+
             value = (value - mean) * tf.rsqrt(variance + util.EPSILON) * scale + offset
 
         if activation_fn is not None:
@@ -805,7 +1542,7 @@ class ResNet(Net):
         else:
             stride = (1, 1)
 
-        out_channel_inner = out_channel
+        (out_channel_inner_a, out_channel_inner_b) = self.channels.get(name, (out_channel, out_channel))
         out_channel_outer = 4 * out_channel
 
         with tf.variable_scope(name):
@@ -814,16 +1551,39 @@ class ResNet(Net):
             else:
                 value1 = value
 
-            value2 = self.conv(value, 'res%s_branch2a' % name, out_channel=out_channel_inner, stride=stride, norm_name='%s_branch2a' % name, activation_fn=tf.nn.relu, learning_mode=learning_mode)
-            value2 = self.conv(value2, 'res%s_branch2b' % name, out_channel=out_channel_inner, size=(3, 3), norm_name='%s_branch2b' % name, activation_fn=tf.nn.relu, learning_mode=learning_mode)
+            value2 = self.conv(value, 'res%s_branch2a' % name, out_channel=out_channel_inner_a, stride=stride, norm_name='%s_branch2a' % name, activation_fn=tf.nn.relu, learning_mode=learning_mode)
+            value2 = self.conv(value2, 'res%s_branch2b' % name, out_channel=out_channel_inner_b, size=(3, 3), norm_name='%s_branch2b' % name, activation_fn=tf.nn.relu, learning_mode=learning_mode)
             value2 = self.conv(value2, 'res%s_branch2c' % name, out_channel=out_channel_outer, norm_name='%s_branch2c' % name, learning_mode=learning_mode)
 
             value = tf.nn.relu(value1 + value2)
         return value
 
-    def block(self, value, name, num_units, subsample, out_channel, learning_mode='normal'):
+    def basic_unit(self, value, name, subsample, out_channel, learning_mode='normal'):
+        in_channel = ImageUtil.get_channel(value)
+
+        if subsample:
+            stride = (2, 2)
+        else:
+            stride = (1, 1)
+
+        with tf.variable_scope(name):
+            if subsample or in_channel != out_channel:
+                value1 = self.conv(value, 'res%s_basic1' % name, out_channel=out_channel, stride=stride, norm_name='%s_basic1' % name, learning_mode=learning_mode)
+            else:
+                value1 = value
+
+            value2 = self.conv(value, 'res%s_basic2a' % name, out_channel=out_channel, size=(3, 3), stride=stride, norm_name='%s_basic2a' % name, activation_fn=tf.nn.relu, learning_mode=learning_mode)
+            value2 = self.conv(value2, 'res%s_basic2b' % name, out_channel=out_channel, size=(3, 3), norm_name='%s_basic2b' % name, learning_mode=learning_mode)
+
+            value = tf.nn.relu(value1 + value2)
+        return value
+
+    def block(self, value, name, num_units, subsample, out_channel, learning_mode='normal', unit_fn=None):
+        if unit_fn is None:
+            unit_fn = self.unit
+
         for num_unit in xrange(num_units):
-            value = self.unit(value, '%s%c' % (name, ord('a') + num_unit), subsample=subsample and num_unit == 0, out_channel=out_channel, learning_mode=learning_mode)
+            value = unit_fn(value, '%s%c' % (name, ord('a') + num_unit), subsample=subsample and num_unit == 0, out_channel=out_channel, learning_mode=learning_mode)
         return value
 
     def softmax(self, value, dim):
@@ -863,17 +1623,34 @@ class ResNet(Net):
 
 
 class ResNet50(ResNet):
+    BLOCKS = [('2', 3, False, 64, 'slow'), ('3', 4, True, 128, 'slow'), ('4', 6, True, 256, 'normal'), ('5', 3, True, 512, 'normal')]
+    EXIT_BLOCKS = ()
+    EXIT_SCOPE = 'exit%s'
+    EXIT_WEIGHT = 0.3
+    EXIT_THRESHOLD = 1.0
+
     def __init__(self,
                  learning_rate=Net.LEARNING_RATE,
                  learning_modes=Net.LEARNING_RATE_MODES,
                  learning_rate_decay_steps=Net.LEARNING_RATE_DECAY_STEPS,
                  learning_rate_decay_rate=Net.LEARNING_RATE_DECAY_RATE,
                  weight_decay=Net.WEIGHT_DECAY,
+                 num_accum_steps=Net.NUM_ACCUM_STEPS,
                  gpu_frac=Net.GPU_FRAC,
+                 num_intra_threads=Net.NUM_INTRA_THREADS,
+                 num_inter_threads=Net.NUM_INTER_THREADS,
+                 working_dir=None,
+                 net_collection=Net.NET_VARIABLES,
                  resnet_params_path=ResNet.RESNET_PARAMS_PATH,
                  num_test_crops=ResNet.NUM_TEST_CROPS,
+                 channels=None,
+                 exit_blocks=EXIT_BLOCKS,
+                 exit_weight=EXIT_WEIGHT,
                  is_train=False,
-                 is_show=False):
+                 is_show=False,
+                 is_profile=False):
+
+        learning_modes = dict(dict(fc=learning_modes['normal'], exit=learning_modes['normal']), **learning_modes)
 
         super(ResNet50, self).__init__(
             learning_rate=learning_rate,
@@ -881,32 +1658,141 @@ class ResNet50(ResNet):
             learning_rate_decay_steps=learning_rate_decay_steps,
             learning_rate_decay_rate=learning_rate_decay_rate,
             weight_decay=weight_decay,
+            num_accum_steps=num_accum_steps,
             gpu_frac=gpu_frac,
+            num_intra_threads=num_intra_threads,
+            num_inter_threads=num_inter_threads,
+            working_dir=working_dir,
+            net_collection=net_collection,
             resnet_params_path=resnet_params_path,
             num_test_crops=num_test_crops,
+            channels=channels,
             is_train=is_train,
-            is_show=is_show)
-
-    def build(self, blob):
-        assert len(blob.as_tuple_list()) == 1, 'Must pass in a single pair of image and label'
-        (self.image, self.label) = blob.as_tuple_list()[0]
+            is_show=is_show,
+            is_profile=is_profile)
+
+        self.exit_blocks = tuple(exit_blocks)
+        self.exit_weight = exit_weight
+        self.block_flops = dict()
+        self.allow_missing = tuple('%s/' % (ResNet50.EXIT_SCOPE % name) for name in self.exit_blocks)
+        if self.exit_blocks:
+            self.SHOW_ATTRS = Net.SHOW_ATTRS + ['exit%s_%s' % (name, attr) for name in self.exit_blocks for attr in Net.SHOW_ATTRS]
+
+    def forward_blocks(self, value, blocks):
+        for (name, num_units, subsample, out_channel, learning_mode) in blocks:
+            value = self.block(value, name, num_units=num_units, subsample=subsample, out_channel=out_channel, learning_mode=learning_mode)
+            setattr(self, 'v%s' % name, value)
+            self.block_flops[name] = self.flops
+        return value
 
+    def forward_trunk(self, image):
         with tf.variable_scope('1'):
-            self.v0 = self.conv(self.image, 'conv1', size=(7, 7), stride=(2, 2), out_channel=64, biased=True, norm_name='_conv1', activation_fn=tf.nn.relu, learning_mode='slow')
+            self.v0 = self.conv(image, 'conv1', size=(7, 7), stride=(2, 2), out_channel=64, biased=True, norm_name='_conv1', activation_fn=tf.nn.relu, learning_mode='slow')
             self.v1 = self.max_pool(self.v0, 'max_pool', size=(3, 3), stride=(2, 2))
 
-        self.v2 = self.block(self.v1, '2', num_units=3, subsample=False, out_channel=64, learning_mode='slow')
-        self.v3 = self.block(self.v2, '3', num_units=4, subsample=True, out_channel=128, learning_mode='slow')
-        self.v4 = self.block(self.v3, '4', num_units=6, subsample=True, out_channel=256, learning_mode='normal')
-        self.v5 = self.block(self.v4, '5', num_units=3, subsample=True, out_channel=512, learning_mode='normal')
+        self.forward_blocks(self.v1, ResNet50.BLOCKS[:2])
+
+    def forward_head(self, value, num_classes=None):
+        if num_classes is None:
+            num_classes = len(META.class_names)
+
+        self.forward_blocks(value, ResNet50.BLOCKS[2:])
 
         with tf.variable_scope('fc'):
-            self.v6 = self.avg_pool(self.v5, 'avg_pool', size=(7, 7))
+            self.v6 = self.global_avg_pool(self.v5, 'avg_pool')
             self.v6_ = tf.squeeze(self.v6, (1, 2))
-            self.v7 = self.conv(self.v6, 'fc', out_channel=len(META.class_names), biased=True)
+            self.v7 = self.conv(self.v6, 'fc', out_channel=num_classes, biased=True, learning_mode='fc')
+            self.v7_ = tf.squeeze(self.v7, (1, 2))
             self.v8 = self.softmax(self.v7, 3)
             self.v8_ = tf.squeeze(self.v8, (1, 2))
 
+    def forward(self, image):
+        self.forward_trunk(image)
+        self.forward_head(self.v3)
+
+    def forward_exit(self, value, name):
+        with tf.variable_scope(ResNet50.EXIT_SCOPE % name):
+            value = self.global_avg_pool(value, 'avg_pool')
+            value = self.conv(value, 'exit%s_fc' % name, out_channel=len(META.class_names), biased=True, learning_mode='exit')
+            value = tf.squeeze(value, (1, 2))
+        return value
+
+    def make_exits(self):
+        self.net_flops = self.flops
+        self.exit_flops = dict()
+        self.exit_probs = dict()
+        for name in self.exit_blocks:
+            flops = self.flops
+            logit = self.forward_exit(getattr(self, 'v%s' % name), name)
+            self.exit_flops[name] = self.flops - flops
+            self.exit_probs[name] = tf.reduce_mean(self.rebatch(self.softmax(logit, 1)), 1)
+
+    def make_early_exit(self):
+        self.exit_threshold = Net.placeholder('exit_threshold', default=ResNet50.EXIT_THRESHOLD)
+
+        first = min(self.exit_blocks)
+        value = getattr(self, 'v%s' % first)
+        ids = tf.range(tf.shape(self.exit_probs[first])[0])
+        num_images = tf.to_float(tf.shape(ids)[0])
+        num_crops = tf.shape(value)[0] / tf.shape(ids)[0]
+
+        flops = self.flops
+        cost = tf.constant(float(self.block_flops[first]))
+        (ids_list, prob_list) = (list(), list())
+        self.exit_fracs = dict()
+        with tf.variable_scope(tf.get_variable_scope(), reuse=True):
+            for (name, num_units, subsample, out_channel, learning_mode) in ResNet50.BLOCKS:
+                if name <= first:
+                    is_full = True
+                else:
+                    flops_ = self.flops
+                    value = self.block(value, name, num_units=num_units, subsample=subsample, out_channel=out_channel, learning_mode=learning_mode)
+                    cost += tf.to_float(tf.shape(ids)[0]) / num_images * (self.flops - flops_)
+                    is_full = False
+
+                if name not in self.exit_blocks:
+                    continue
+
+                if is_full:
+                    prob = self.exit_probs[name]
+                else:
+                    prob = tf.reduce_mean(self.rebatch(self.softmax(self.forward_exit(value, name), 1)), 1)
+                cost += tf.to_float(tf.shape(ids)[0]) / num_images * self.exit_flops[name]
+
+                is_exit = tf.reduce_max(prob, 1) >= self.exit_threshold
+                is_kept = tf.logical_not(is_exit)
+                ids_list.append(tf.boolean_mask(ids, is_exit))
+                prob_list.append(tf.boolean_mask(prob, is_exit))
+                self.exit_fracs[name] = tf.to_float(tf.shape(ids_list[-1])[0]) / num_images
+
+                ids = tf.boolean_mask(ids, is_kept)
+                value = tf.boolean_mask(value, tf.reshape(tf.tile(tf.expand_dims(is_kept, 1), tf.pack([1, num_crops])), (-1,)))
+
+            with tf.variable_scope('fc'):
+                flops_ = self.flops
+                value = self.global_avg_pool(value, 'avg_pool')
+                value = self.conv(value, 'fc', out_channel=len(META.class_names), biased=True, learning_mode='fc')
+                cost += tf.to_float(tf.shape(ids)[0]) / num_images * (self.flops - flops_)
+            ids_list.append(ids)
+            prob_list.append(tf.reduce_mean(self.rebatch(self.softmax(tf.squeeze(value, (1, 2)), 1)), 1))
+        self.flops = flops
+
+        self.exit_prob = tf.dynamic_stitch(ids_list, prob_list)
+        self.exit_correct = tf.to_float(tf.equal(self.label, tf.argmax(self.exit_prob, 1)))
+        self.exit_acc = tf.reduce_mean(self.exit_correct)
+        self.exit_saving = 1 - cost / self.net_flops
+
+    def make_stat(self):
+        super(ResNet50, self).make_stat()
+
+        for name in self.exit_blocks:
+            prob = self.exit_probs[name]
+            loss = - tf.reduce_mean(self.target * tf.log(prob + util.EPSILON)) * len(META.class_names)
+            setattr(self, 'exit%s_loss' % name, loss)
+            setattr(self, 'exit%s_acc' % name, tf.reduce_mean(tf.to_float(tf.equal(self.label, tf.argmax(prob, 1)))))
+            self.loss += self.exit_weight * loss
+
+    def make_prob(self):
         _feat = self.rebatch(self.v6_)
         self.feat = tf.reduce_mean(_feat, 1)
         _prob = self.rebatch(self.v8_)
@@ -914,73 +1800,398 @@ class ResNet50(ResNet):
         _consistency = - tf.reduce_sum(tf.expand_dims(self.prob, 1) * tf.log(_prob), 2)
         self.consistency = tf.exp(- tf.reduce_mean(_consistency, 1))
 
+    def build(self, blob):
+        assert len(blob.as_tuple_list()) == 1, 'Must pass in a single pair of image and label'
+        (self.image, self.label) = blob.as_tuple_list()[0]
+
+        self.forward(self.image)
+        self.make_prob()
+        if self.exit_blocks:
+            self.make_exits()
+            self.make_early_exit()
         self.make_stat()
 
         if self.is_train:
             self.make_train_op()
+            self.profiler.add_stamp('train/input', self.label)
+            self.profiler.add_stamp('train/compute', self.train_op)
 
         if self.is_show:
             self.make_show()
 
         self.finalize()
 
-    def train(self, iteration=0, feed_dict=dict(), save_per=-1):
+    def _test_and_resume(self, feed_dict):
+        self.test(feed_dict=feed_dict)
+        self.sess.run(self.phase_assign, feed_dict={self.phase: Net.Phase.TRAIN.value})
+
+    def train(self, iteration=0, feed_dict=dict(), save_per=-1, profile_per=Net.PROFILE_PER, schedule=None, extra_callbacks=()):
         self.sess.run(self.phase_assign, feed_dict={self.phase: Net.Phase.TRAIN.value})
 
         train_dict = dict(train=self.train_op)
         show_dict = self.show_dict[Net.Phase.TRAIN]
         summary_dict = dict(summary=self.summary[Net.Phase.TRAIN])
+        profiler = self.profiler
+
+        # iteration and intervals count optimizer updates, each of which takes num_accum_steps runs
+        num_accum_steps = self.num_accum_steps
+
+        def scale(callback):
+            if callback.get('interval', 0) > 0:
+                return dict(callback, interval=callback['interval'] * num_accum_steps)
+            return callback
+
+        callbacks = [
+            dict(fetch=util.merge_dicts(train_dict, show_dict, summary_dict)),
+            dict(interval=1,
+                 fetch=show_dict,
+                 func=profiler.wrap('train/display', lambda **kwargs: self.model.display(begin='Train', end='\n', **kwargs))),
+            dict(interval=5,
+                 fetch=summary_dict,
+                 func=profiler.wrap('train/summary', lambda **kwargs: self.model.summary(summary_writer=self.summary_writer, **kwargs))),
+            dict(interval=5,
+                 func=lambda **kwargs: self._test_and_resume(feed_dict=feed_dict)),
+            dict(interval=save_per,
+                 func=profiler.wrap('train/save', lambda **kwargs: self.model.save(saver=self.saver, saver_kwargs=dict(save_path=self.model_path, global_step=None), **kwargs)))]
+        callbacks.extend(extra_callbacks)
+        callbacks = map(scale, callbacks)
+
+        if schedule is not None:
+            schedule.update(self.sess, self.sess.run(self.global_step))
+            callbacks.append(dict(
+                fetch=dict(schedule_step=self.global_step),
+                func=lambda **kwargs: schedule.update(self.sess, kwargs['schedule_step'])))
+
+        if profiler.is_enabled:
+            callbacks[1:1] = [
+                dict(func=lambda **kwargs: profiler.lap('train/run', since='train/step')),
+                dict(fetch=profiler.stamps, func=lambda **kwargs: profiler.record_stamps(kwargs, since='train/step', name='train/fetch'))]
+            if profiler.values:
+                callbacks.append(dict(fetch=profiler.values, func=lambda **kwargs: profiler.record_values(kwargs)))
+            callbacks.extend([
+                dict(interval=profile_per * num_accum_steps,
+                     func=profiler.wrap('train/profile', lambda **kwargs: self.export_profile())),
+                dict(func=lambda **kwargs: profiler.tick('train/step'))])
+            profiler.tick('train/step')
 
         self.model.train(
-            iteration=iteration,
+            iteration=iteration * num_accum_steps,
             feed_dict=feed_dict,
-            callbacks=[
-                dict(fetch=util.merge_dicts(train_dict, show_dict, summary_dict)),
-                dict(fetch=show_dict,
-                     func=lambda **kwargs: self.model.display(begin='Train', end='\n', **kwargs)),
-                dict(interval=5,
-                     fetch=summary_dict,
-                     func=lambda **kwargs: self.model.summary(summary_writer=self.summary_writer, **kwargs)),
-                dict(interval=5,
-                     func=lambda **kwargs: self.test(feed_dict=feed_dict)),
-                dict(interval=save_per,
-                     func=lambda **kwargs: self.model.save(saver=self.saver, saver_kwargs=dict(save_path=self.model_path, global_step=None), **kwargs))])
+            callbacks=callbacks)
+
+        if profiler.is_enabled:
+            self.export_profile()
 
     def test(self, iteration=1, feed_dict=dict()):
         self.sess.run(self.phase_assign, feed_dict={self.phase: Net.Phase.TEST.value})
 
         show_dict = self.show_dict[Net.Phase.TEST]
         summary_dict = dict(summary=self.summary[Net.Phase.TEST])
-
-        self.model.test(
-            iteration=iteration,
-            feed_dict=feed_dict,
-            callbacks=[
-                dict(fetch=util.merge_dicts(show_dict, summary_dict)),
-                dict(fetch=show_dict,
-                     func=lambda **kwargs: self.model.display(begin='\033[2K\rTest', end='\n', **kwargs)),
-                dict(fetch=summary_dict,
-                     func=lambda **kwargs: self.model.summary(summary_writer=self.summary_writer, **kwargs))])
+        profiler = self.profiler
+
+        with profiler.phase('test'):
+            self.model.test(
+                iteration=iteration,
+                feed_dict=feed_dict,
+                callbacks=[
+                    dict(fetch=util.merge_dicts(show_dict, summary_dict)),
+                    dict(fetch=show_dict,
+                         func=profiler.wrap('display', lambda **kwargs: self.model.display(begin='\033[2K\rTest', end='\n', **kwargs))),
+                    dict(fetch=summary_dict,
+                         func=profiler.wrap('summary', lambda **kwargs: self.model.summary(summary_writer=self.summary_writer, **kwargs)))])
 
     def online(self, feed_dict=dict(), fetch=dict()):
         self.sess.run(self.phase_assign, feed_dict={self.phase: Net.Phase.TEST.value})
 
-        self.model.test(
-            iteration=1,
-            feed_dict=feed_dict,
-            callbacks=[
-                dict(fetch=fetch)])
+        with self.profiler.phase('online'):
+            self.model.test(
+                iteration=1,
+                feed_dict=feed_dict,
+                callbacks=[
+                    dict(fetch=fetch)])
 
         return self.model.output_values
 
+    def evaluate(self, num_images, feed_dict=dict(), fetch=dict()):
+        fetch = dict(fetch, evaluate_label=self.label)
+
+        values = {key: list() for key in fetch}
+        num_evaluated = 0
+        while num_evaluated < num_images:
+            values_ = self.online(feed_dict=feed_dict, fetch=fetch)
+            num_rows = min(len(values_['evaluate_label']), num_images - num_evaluated)
+            for key in fetch:
+                value = np.asarray(values_[key])
+                if value.ndim == 0:
+                    value = np.repeat(value, num_rows)
+                values[key].append(value[:num_rows])
+            num_evaluated += num_rows
+
+        values = {key: np.concatenate(value) if value else np.zeros(0) for (key, value) in values.iteritems()}
+        values.pop('evaluate_label')
+        return values
+
+
+class ResNetStudent(ResNet50):
+    NUM_UNITS = (2, 2, 2, 2)
+    OUT_CHANNELS = (64, 128, 256, 512)
+    UNIT = 'basic'
+    TEACHER_VARIABLES = 'teacher_variables'
+    TEACHER_SCOPE = 'teacher'
+    TEMPERATURE = 4.0
+    DISTILL_WEIGHT = 0.9
+    BATCH_NORM_DECAY = 0.99
+
+    def __init__(self,
+                 learning_rate=Net.LEARNING_RATE,
+                 learning_rate_decay_steps=Net.LEARNING_RATE_DECAY_STEPS,
+                 learning_rate_decay_rate=Net.LEARNING_RATE_DECAY_RATE,
+                 weight_decay=Net.WEIGHT_DECAY,
+                 gpu_frac=Net.GPU_FRAC,
+                 num_intra_threads=Net.NUM_INTRA_THREADS,
+                 num_inter_threads=Net.NUM_INTER_THREADS,
+                 num_test_crops=ResNet.NUM_TEST_CROPS,
+                 num_units=NUM_UNITS,
+                 out_channels=OUT_CHANNELS,
+                 unit=UNIT,
+                 teacher_dir=None,
+                 temperature=TEMPERATURE,
+                 distill_weight=DISTILL_WEIGHT,
+                 batch_norm_decay=BATCH_NORM_DECAY,
+                 is_train=False,
+                 is_show=False,
+                 is_profile=False):
+
+        super(ResNetStudent, self).__init__(
+            learning_rate=learning_rate,
+            learning_rate_decay_steps=learning_rate_decay_steps,
+            learning_rate_decay_rate=learning_rate_decay_rate,
+            weight_decay=weight_decay,
+            gpu_frac=gpu_frac,
+            num_intra_threads=num_intra_threads,
+            num_inter_threads=num_inter_threads,
+            resnet_params_path=None,
+            num_test_crops=num_test_crops,
+            is_train=is_train,
+            is_show=is_show,
+            is_profile=is_profile)
+
+        assert len(num_units) == len(out_channels) == 4, 'Student must have four blocks!'
+
+        self.num_units = num_units
+        self.out_channels = out_channels
+        self.unit_fn = dict(basic=self.basic_unit, bottleneck=self.unit)[unit]
+        self.temperature = temperature
+        self.distill_weight = distill_weight
+        self.batch_norm_decay = batch_norm_decay
+
+        if teacher_dir is None:
+            self.teacher = None
+        else:
+            with tf.variable_scope(ResNetStudent.TEACHER_SCOPE):
+                self.teacher = ResNet50(
+                    learning_modes=dict(normal=0.0, slow=0.0),
+                    gpu_frac=gpu_frac,
+                    num_intra_threads=num_intra_threads,
+                    num_inter_threads=num_inter_threads,
+                    working_dir=teacher_dir,
+                    net_collection=ResNetStudent.TEACHER_VARIABLES,
+                    num_test_crops=num_test_crops)
+            assert os.path.isfile(self.teacher.model_path), 'No teacher model found in %s!' % teacher_dir
+            self.SHOW_ATTRS = Net.SHOW_ATTRS + ['distill_loss', 'teacher_acc']
+
+    def forward(self, image):
+        with tf.variable_scope('1'):
+            self.v0 = self.conv(image, 'conv1', size=(7, 7), stride=(2, 2), out_channel=self.out_channels[0], biased=True, norm_name='_conv1', activation_fn=tf.nn.relu)
+            self.v1 = self.max_pool(self.v0, 'max_pool', size=(3, 3), stride=(2, 2))
+
+        value = self.v1
+        for (num_block, (num_units, out_channel)) in enumerate(zip(self.num_units, self.out_channels)):
+            value = self.block(value, str(num_block + 2), num_units=num_units, subsample=num_block > 0, out_channel=out_channel, unit_fn=self.unit_fn)
+            setattr(self, 'v%d' % (num_block + 2), value)
+
+        with tf.variable_scope('fc'):
+            self.v6 = self.global_avg_pool(value, 'avg_pool')
+            self.v6_ = tf.squeeze(self.v6, (1, 2))
+            self.v7 = self.conv(self.v6, 'fc', out_channel=len(META.class_names), biased=True)
+            self.v7_ = tf.squeeze(self.v7, (1, 2))
+            self.v8 = self.softmax(self.v7, 3)
+            self.v8_ = tf.squeeze(self.v8, (1, 2))
+
+    def make_stat(self):
+        super(ResNetStudent, self).make_stat()
+
+        if self.teacher is not None:
+            with tf.variable_scope(ResNetStudent.TEACHER_SCOPE):
+                self.teacher.forward(self.image)
+
+            soft_target = self.softmax(self.teacher.v7_ / self.temperature, 1)
+            log_soft_prob = tf.log(self.softmax(self.v7_ / self.temperature, 1) + util.EPSILON)
+            self.distill_loss = - tf.reduce_mean(tf.reduce_sum(soft_target * log_soft_prob, 1)) * self.temperature ** 2
+            self.loss = (1 - self.distill_weight) * self.loss + self.distill_weight * self.distill_loss
+
+            self.teacher_prob = tf.reduce_mean(self.rebatch(self.teacher.v8_), 1)
+            self.teacher_correct = tf.to_float(tf.equal(self.label, tf.argmax(self.teacher_prob, 1)))
+            self.teacher_acc = tf.reduce_mean(self.teacher_correct)
+
+    def finalize(self):
+        super(ResNetStudent, self).finalize()
+
+        if self.teacher is not None:
+            prefix = '%s/' % ResNetStudent.TEACHER_SCOPE
+            teacher_saver = tf.train.Saver({
+                var.op.name[len(prefix):]: var for var in tf.get_collection(ResNetStudent.TEACHER_VARIABLES)})
+            teacher_saver.restore(self.sess, self.teacher.model_path)
+            print('Teacher restored from %s' % self.teacher.model_path)
+
+
+class SharedResNet50(ResNet50):
+    TRUNK_SCOPES = ['1'] + ['2%c' % (ord('a') + num_unit) for num_unit in xrange(3)] + ['3%c' % (ord('a') + num_unit) for num_unit in xrange(4)]
+    HEAD_SCOPE = 'head%d'
+
+    @staticmethod
+    def check_trunks(model_paths, trunk_scopes=TRUNK_SCOPES):
+        readers = [tf.train.NewCheckpointReader(model_path) for model_path in model_paths]
+        var_names = [
+            var_name for var_name in readers[0].get_variable_to_shape_map()
+            if var_name.split('/')[0] in trunk_scopes]
+
+        for (model_path, reader) in zip(model_paths[1:], readers[1:]):
+            for var_name in var_names:
+                if not reader.has_tensor(var_name) or not np.array_equal(readers[0].get_tensor(var_name), reader.get_tensor(var_name)):
+                    raise ValueError('%s differs between %s and %s!' % (var_name, model_paths[0], model_path))
+
+    def __init__(self,
+                 working_dirs,
+                 gpu_frac=Net.GPU_FRAC,
+                 num_intra_threads=Net.NUM_INTRA_THREADS,
+                 num_inter_threads=Net.NUM_INTER_THREADS,
+                 num_test_crops=ResNet.NUM_TEST_CROPS,
+                 is_profile=False):
+
+        self.metas = [Meta.test(working_dir=working_dir) for working_dir in working_dirs]
+        self.model_paths = [os.path.join(working_dir, Net.MODEL_FILENAME) for working_dir in working_dirs]
+        SharedResNet50.check_trunks(self.model_paths)
+        if META is None:
+            set_meta(self.metas[0])
+
+        super(SharedResNet50, self).__init__(
+            gpu_frac=gpu_frac,
+            num_intra_threads=num_intra_threads,
+            num_inter_threads=num_inter_threads,
+            working_dir=working_dirs[0],
+            num_test_crops=num_test_crops,
+            is_profile=is_profile)
+
+        # The trunk takes its channels from working_dirs[0], check_trunks has made sure the others match
+        self.head_channels = list()
+        for working_dir in working_dirs:
+            channels_path = os.path.join(working_dir, Pruning.CHANNELS_FILENAME)
+            self.head_channels.append(Pruning.load_channels(channels_path) if os.path.isfile(channels_path) else dict())
+
+    def build(self, blob):
+        assert len(blob.as_tuple_list()) == 1, 'Must pass in a single pair of image and label'
+        (self.image, self.label) = blob.as_tuple_list()[0]
+
+        self.forward_trunk(self.image)
+
+        self.heads = list()
+        for (num_head, meta) in enumerate(self.metas):
+            self.channels = self.head_channels[num_head]
+            with tf.variable_scope(SharedResNet50.HEAD_SCOPE % num_head):
+                self.forward_head(self.v3, num_classes=len(meta.class_names))
+            self.make_prob()
+            self.heads.append(dict(
+                class_names=meta.class_names,
+                feat=self.feat,
+                prob=self.prob,
+                consistency=self.consistency))
+
+        self.finalize()
+
+    def finalize(self):
+        self.sess = tf.InteractiveSession(config=self.get_session_config())
+        self.sess.run(tf.initialize_all_variables())
+
+        variables = tf.get_collection(self.net_collection)
+        trunk_variables = [var for var in variables if var.op.name.split('/')[0] in SharedResNet50.TRUNK_SCOPES]
+        tf.train.Saver(trunk_variables).restore(self.sess, self.model_paths[0])
+
+        for (num_head, model_path) in enumerate(self.model_paths):
+            prefix = '%s/' % (SharedResNet50.HEAD_SCOPE % num_head)
+            head_variables = {var.op.name[len(prefix):]: var for var in variables if var.op.name.startswith(prefix)}
+            tf.train.Saver(head_variables).restore(self.sess, model_path)
+            print('Head %d restored from %s' % (num_head, model_path))
+
+        self.model = Model(self.global_step)
+
 
 class Postprocess(object):
-    def __init__(self):
-        pass
+    TOP_K = 5
+    MIN_PROB = 0.0
+    MIN_CONSISTENCY = 0.0
+    UNKNOWN_NAME = 'unknown'
+
+    def __init__(self,
+                 top_k=TOP_K,
+                 min_prob=MIN_PROB,
+                 min_consistency=MIN_CONSISTENCY,
+                 unknown_name=UNKNOWN_NAME):
+
+        self.top_k = top_k
+        self.min_prob = min_prob
+        self.min_consistency = min_consistency
+        self.unknown_name = unknown_name
 
     def blob(self, values):
         return Blob(values=values)
 
+    def build(self, blob):
+        (prob, consistency) = blob.values
+        top_k = min(self.top_k, len(META.class_names))
+
+        class_names = tf.constant(META.class_names, dtype=tf.string)
+        (self.scores, self.indices) = tf.nn.top_k(prob, k=top_k)
+        self.names = tf.gather(class_names, self.indices)
+        self.is_known = tf.logical_and(
+            tf.greater_equal(self.scores[:, 0], self.min_prob),
+            tf.greater_equal(consistency, self.min_consistency))
+        self.name = tf.select(self.is_known, self.names[:, 0], tf.fill(tf.shape(self.is_known), self.unknown_name))
+
+        return Blob(values=[self.indices, self.names, self.scores, self.is_known, self.name])
+
+    def kwargs(self):
+        return dict(
+            feed_dict=dict(),
+            fetch=dict(
+                indices=self.indices,
+                names=self.names,
+                scores=self.scores,
+                is_known=self.is_known,
+                name=self.name))
+
+    def apply(self, prob, consistency):
+        top_k = min(self.top_k, prob.shape[1])
+        rows = np.arange(prob.shape[0])[:, None]
+
+        indices = np.argpartition(-prob, top_k - 1, axis=1)[:, :top_k]
+        scores = prob[rows, indices]
+        order = np.argsort(-scores, axis=1)
+        indices = indices[rows, order]
+        scores = scores[rows, order]
+
+        class_names = np.asarray(META.class_names)
+        names = class_names[indices]
+        is_known = (scores[:, 0] >= self.min_prob) & (np.asarray(consistency) >= self.min_consistency)
+        name = np.where(is_known, names[:, 0], self.unknown_name)
+
+        return dict(
+            indices=indices,
+            names=names,
+            scores=scores,
+            is_known=is_known,
+            name=name)
+
 
 class Consumer(object):
     BATCH_SIZE = 64
@@ -1027,6 +2238,172 @@ class Consumer(object):
             fetch=dict(consumer_assign=self.assign))
 
 
+class Profiler(object):
+    WINDOW = 1024
+    PERCENTILES = (50, 90, 99)
+
+    class Phase(object):
+        def __init__(self, profiler, name):
+            self.profiler = profiler
+            self.name = name
+
+        def __enter__(self):
+            self.profiler.stack.append(self.name)
+            self.start = time.time()
+
+        def __exit__(self, type, msg, traceback):
+            duration = time.time() - self.start
+            name = '/'.join(self.profiler.stack)
+            self.profiler.stack.pop()
+            self.profiler.record(name, duration)
+            return False
+
+    class NullPhase(object):
+        def __enter__(self):
+            pass
+
+        def __exit__(self, type, msg, traceback):
+            return False
+
+    def __init__(self,
+                 window=WINDOW,
+                 percentiles=PERCENTILES,
+                 is_enabled=True):
+
+        self.window = window
+        self.percentiles = percentiles
+        self.is_enabled = is_enabled
+
+        self.samples = dict()
+        self.counts = dict()
+        self.marks = dict()
+        self.stack = list()
+        self.values = dict()
+        self.stamps = dict()
+        self.null_phase = Profiler.NullPhase()
+
+    def record(self, name, value):
+        if name not in self.samples:
+            self.samples[name] = np.zeros(self.window, dtype=np.float64)
+            self.counts[name] = 0
+        self.samples[name][self.counts[name] % self.window] = value
+        self.counts[name] += 1
+
+    def record_values(self, values):
+        for (name, value) in values.iteritems():
+            if name in self.values:
+                self.record(name, value)
+
+    def add_value(self, name, value):
+        self.values[name] = value
+
+    def add_stamp(self, name, value):
+        if not self.is_enabled:
+            return
+
+        with tf.control_dependencies([value]):
+            self.stamps[name] = tf.py_func(time.time, [], [tf.float64], name='stamp')[0]
+
+    def record_stamps(self, stamps, since, name):
+        if since not in self.marks:
+            return
+
+        now = time.time()
+        start = self.marks[since]
+        stamps = [(stamp_name, stamps[stamp_name]) for stamp_name in self.stamps if stamp_name in stamps]
+        for (stamp_name, stamp) in sorted(stamps, key=lambda item: item[1]):
+            self.record(stamp_name, stamp - start)
+            start = stamp
+        self.record(name, now - start)
+
+    def phase(self, name):
+        if not self.is_enabled:
+            return self.null_phase
+        return Profiler.Phase(self, name)
+
+    def wrap(self, name, func):
+        if not self.is_enabled:
+            return func
+
+        def wrapped(**kwargs):
+            with self.phase(name):
+                return func(**kwargs)
+        return wrapped
+
+    def lap(self, name, since):
+        if since in self.marks:
+            self.record(name, time.time() - self.marks[since])
+
+    def tick(self, name):
+        now = time.time()
+        if name in self.marks:
+            self.record(name, now - self.marks[name])
+        self.marks[name] = now
+
+    def stats(self):
+        stats = dict()
+        for (name, samples) in self.samples.iteritems():
+            samples = samples[:min(self.counts[name], self.window)]
+            stats[name] = dict(count=self.counts[name], mean=float(np.mean(samples)))
+            for (percentile, value) in zip(self.percentiles, np.percentile(samples, self.percentiles)):
+                stats[name]['p%d' % percentile] = float(value)
+        return stats
+
+    def summary(self):
+        return tf.Summary(value=[
+            tf.Summary.Value(tag='profile/%s/%s' % (name, key), simple_value=value)
+            for (name, stat) in self.stats().iteritems()
+            for (key, value) in stat.iteritems() if key != 'count'])
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.stats(), f, indent=4, sort_keys=True)
+
+
+class Curve(object):
+    def __init__(self, net, num_images):
+        self.net = net
+        self.num_images = num_images
+        self.points = list()
+        self.eval_duration = 0.0
+        self.start = time.time()
+
+    def evaluate(self, **kwargs):
+        start = time.time()
+        acc = np.mean(self.net.evaluate(self.num_images, fetch=dict(correct=self.net.correct))['correct'])
+        self.net.sess.run(self.net.phase_assign, feed_dict={self.net.phase: Net.Phase.TRAIN.value})
+        self.eval_duration += time.time() - start
+
+        step = self.net.sess.run(self.net.global_step)
+        self.points.append((step, time.time() - self.start - self.eval_duration, acc))
+        print('Step %d: %.1f s of training, validation accuracy %.4f' % self.points[-1])
+
+    def callback(self, interval):
+        return dict(interval=interval, func=self.evaluate)
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            for (step, duration, acc) in self.points:
+                f.write('%d\t%.1f\t%.4f\n' % (step, duration, acc))
+
+    def report(self, name, target_acc, results_path):
+        best_acc = max(acc for (_, _, acc) in self.points)
+        target_duration = None
+        if target_acc is not None:
+            reached = [duration for (_, duration, acc) in self.points if acc >= target_acc]
+            if reached:
+                target_duration = reached[0]
+
+        if target_duration is None:
+            print('%s: best accuracy %.4f, target %s not reached' % (name, best_acc, target_acc))
+        else:
+            print('%s: best accuracy %.4f, reached %.4f after %.1f s' % (name, best_acc, target_acc, target_duration))
+
+        with open(results_path, 'a') as f:
+            f.write('%s\t%s\t%.4f\t%s\t%s\n' % (self.net.working_dir, name, best_acc, target_acc, '-' if target_duration is None else '%.1f' % target_duration))
+        print('Results appended to %s' % results_path)
+
+
 class Timer(object):
     def __init__(self, message):
         self.message = message
@@ -0,0 +1,204 @@
+from __future__ import print_function
+
+import glob
+import numpy as np
+import os
+import time
+
+
+def normalize(value):
+    value = np.asarray(value, dtype=np.float32)
+    norm = np.sqrt(np.sum(value * value, axis=-1, keepdims=True))
+    return value / np.maximum(norm, 1e-12)
+
+
+def top_k(scores, k):
+    k = min(k, scores.shape[1])
+    rows = np.arange(scores.shape[0])[:, None]
+
+    indices = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    scores_ = scores[rows, indices]
+    order = np.argsort(-scores_, axis=1)
+    return (indices[rows, order], scores_[rows, order])
+
+
+def merge(best_ids, best_scores, ids, scores, k):
+    (indices, scores) = top_k(scores, k)
+    ids = np.asarray(ids)[indices]
+
+    (indices, scores) = top_k(np.concatenate([best_scores, scores], axis=1), k)
+    ids = np.concatenate([best_ids, ids], axis=1)[np.arange(len(ids))[:, None], indices]
+    return (ids, scores)
+
+
+class FeatureStore(object):
+    FEAT_FILENAME = 'feat.npy'
+    MASK_FILENAME = 'mask.npy'
+    DTYPE = np.float16
+
+    @staticmethod
+    def from_chunks(chunk_dir, store_dir, num_files=None):
+        chunk_paths = sorted(glob.glob(os.path.join(chunk_dir, 'chunk-*.npz')))
+        assert chunk_paths, 'No chunks found in %s!' % chunk_dir
+
+        # A final flush of failed or padded rows leaves a chunk without indices
+        chunk_paths = [chunk_path for chunk_path in chunk_paths if len(np.load(chunk_path)['index'])]
+        assert chunk_paths, 'No features found in the chunks of %s!' % chunk_dir
+
+        if num_files is None:
+            num_files = 1 + max(np.max(np.load(chunk_path)['index']) for chunk_path in chunk_paths)
+        num_dims = np.load(chunk_paths[0])['feat'].shape[1]
+
+        if not os.path.isdir(store_dir):
+            os.makedirs(store_dir)
+
+        feat = np.lib.format.open_memmap(os.path.join(store_dir, FeatureStore.FEAT_FILENAME), mode='w+', dtype=FeatureStore.DTYPE, shape=(num_files, num_dims))
+        mask = np.zeros(num_files, dtype=np.bool)
+        for chunk_path in chunk_paths:
+            chunk = np.load(chunk_path)
+            feat[chunk['index']] = normalize(chunk['feat']).astype(FeatureStore.DTYPE)
+            mask[chunk['index']] = True
+        feat.flush()
+        np.save(os.path.join(store_dir, FeatureStore.MASK_FILENAME), mask)
+
+        return FeatureStore(store_dir)
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.feat = np.load(os.path.join(store_dir, FeatureStore.FEAT_FILENAME), mmap_mode='r')
+        self.mask = np.load(os.path.join(store_dir, FeatureStore.MASK_FILENAME))
+
+
+class BruteForceIndex(object):
+    BATCH_SIZE = 65536
+
+    def __init__(self, feat, ids=None, batch_size=BATCH_SIZE):
+        self.feat = feat
+        self.ids = np.arange(len(feat)) if ids is None else ids
+        self.batch_size = batch_size
+
+    def search(self, queries, k):
+        queries = normalize(queries)
+
+        best_ids = -np.ones((len(queries), k), dtype=np.int64)
+        best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        for start in xrange(0, len(self.feat), self.batch_size):
+            scores = np.dot(queries, self.feat[start:start + self.batch_size].astype(np.float32).T)
+            (best_ids, best_scores) = merge(best_ids, best_scores, self.ids[start:start + self.batch_size], scores, k)
+
+        return (best_ids, best_scores)
+
+
+class IVFIndex(object):
+    NUM_LISTS = 1024
+    NUM_PROBES = 16
+    NUM_ITERATIONS = 10
+    SAMPLE_SIZE = 262144
+    BATCH_SIZE = 65536
+
+    CENTROIDS_FILENAME = 'centroids.npy'
+    OFFSETS_FILENAME = 'offsets.npy'
+    IDS_FILENAME = 'ids.npy'
+    FEAT_FILENAME = 'feat.npy'
+
+    @staticmethod
+    def assign(feat, centroids, ids=None, batch_size=BATCH_SIZE):
+        if ids is None:
+            ids = np.arange(len(feat))
+
+        lists = np.zeros(len(ids), dtype=np.int32)
+        for start in xrange(0, len(ids), batch_size):
+            scores = np.dot(feat[ids[start:start + batch_size]].astype(np.float32), centroids.T)
+            lists[start:start + batch_size] = np.argmax(scores, axis=1)
+        return lists
+
+    @staticmethod
+    def train(feat, ids=None, num_lists=NUM_LISTS, num_iterations=NUM_ITERATIONS, sample_size=SAMPLE_SIZE):
+        if ids is None:
+            ids = np.arange(len(feat))
+        if len(ids) == 0:
+            raise ValueError('Cannot train an index on an empty corpus!')
+        if num_lists > len(ids):
+            print('Only %d vectors, reducing num_lists from %d to %d' % (len(ids), num_lists, len(ids)))
+            num_lists = len(ids)
+
+        sample = np.sort(np.random.choice(ids, max(num_lists, min(sample_size, len(ids))), replace=False))
+        sample = normalize(feat[sample])
+        centroids = sample[np.random.choice(len(sample), num_lists, replace=False)]
+
+        for num_iteration in xrange(num_iterations):
+            lists = IVFIndex.assign(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, lists, sample)
+            counts = np.bincount(lists, minlength=num_lists)
+            empty = counts == 0
+            sums[empty] = sample[np.random.choice(len(sample), np.sum(empty), replace=False)]
+            centroids = normalize(sums)
+
+        return centroids
+
+    @staticmethod
+    def build(feat, index_dir, ids=None, num_lists=NUM_LISTS, num_iterations=NUM_ITERATIONS, sample_size=SAMPLE_SIZE):
+        if ids is None:
+            ids = np.arange(len(feat))
+        if not os.path.isdir(index_dir):
+            os.makedirs(index_dir)
+
+        centroids = IVFIndex.train(feat, ids=ids, num_lists=num_lists, num_iterations=num_iterations, sample_size=sample_size)
+        lists = IVFIndex.assign(feat, centroids, ids=ids)
+        order = np.argsort(lists, kind='mergesort')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(lists, minlength=len(centroids)))])
+
+        feat_ = np.lib.format.open_memmap(os.path.join(index_dir, IVFIndex.FEAT_FILENAME), mode='w+', dtype=feat.dtype, shape=(len(ids),) + feat.shape[1:])
+        for start in xrange(0, len(order), IVFIndex.BATCH_SIZE):
+            feat_[start:start + IVFIndex.BATCH_SIZE] = feat[ids[order[start:start + IVFIndex.BATCH_SIZE]]]
+        feat_.flush()
+
+        np.save(os.path.join(index_dir, IVFIndex.CENTROIDS_FILENAME), centroids)
+        np.save(os.path.join(index_dir, IVFIndex.OFFSETS_FILENAME), offsets)
+        np.save(os.path.join(index_dir, IVFIndex.IDS_FILENAME), ids[order])
+
+        return IVFIndex(index_dir)
+
+    def __init__(self, index_dir, num_probes=NUM_PROBES):
+        self.index_dir = index_dir
+        self.num_probes = num_probes
+
+        self.centroids = np.load(os.path.join(index_dir, IVFIndex.CENTROIDS_FILENAME))
+        self.offsets = np.load(os.path.join(index_dir, IVFIndex.OFFSETS_FILENAME))
+        self.ids = np.load(os.path.join(index_dir, IVFIndex.IDS_FILENAME), mmap_mode='r')
+        self.feat = np.load(os.path.join(index_dir, IVFIndex.FEAT_FILENAME), mmap_mode='r')
+
+    def search(self, queries, k, num_probes=None):
+        if num_probes is None:
+            num_probes = self.num_probes
+        queries = normalize(queries)
+
+        (probes, _) = top_k(np.dot(queries, self.centroids.T), num_probes)
+
+        best_ids = -np.ones((len(queries), k), dtype=np.int64)
+        best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        for list_id in np.unique(probes):
+            (start, end) = self.offsets[list_id:list_id + 2]
+            if start == end:
+                continue
+
+            rows = np.flatnonzero(np.any(probes == list_id, axis=1))
+            scores = np.dot(queries[rows], self.feat[start:end].astype(np.float32).T)
+            (best_ids[rows], best_scores[rows]) = merge(best_ids[rows], best_scores[rows], self.ids[start:end], scores, k)
+
+        return (best_ids, best_scores)
+
+
+def recall(ids, true_ids):
+    hits = [len(np.intersect1d(ids_, true_ids_)) for (ids_, true_ids_) in zip(ids, true_ids)]
+    return float(np.sum(hits)) / true_ids.size
+
+
+def benchmark(index, queries, k, batch_size):
+    start = time.time()
+    ids = list()
+    for start_ in xrange(0, len(queries), batch_size):
+        ids.append(index.search(queries[start_:start_ + batch_size], k)[0])
+    duration = time.time() - start
+    return (np.concatenate(ids), len(queries) / duration)
@@ -1,6 +1,9 @@
 import time
 
 IS_IMAGE_ALREADY_CHECKED = True
+IS_AUTOTUNE = False
+NUM_ACCUM_STEPS = 1
+DUPLICATES_PATH = None
 CURRENT_TIME = time.strftime('%Y-%m-%d-%H%M%S')
 
 # CONTENT_TYPE
@@ -0,0 +1,61 @@
+from __future__ import print_function
+
+import argparse
+import numpy as np
+import os
+import tensorflow as tf
+import time
+
+from ResNet import ROOT_PATH, set_meta, Meta, Blob, Preprocess, Batch, Net, ResNet50
+from main_bench_latency import get_peak_rss
+
+RESULTS_PATH = os.path.join(ROOT_PATH, 'bench-accum.tsv')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark ResNet50 training throughput and memory with gradient accumulation.')
+    parser.add_argument('--num_accum_steps', type=int, default=1, help='Micro-batches per optimizer update')
+    parser.add_argument('--batch_size', type=int, default=Batch.BATCH_SIZE, help='Effective batch size')
+    parser.add_argument('--num_classes', type=int, default=100)
+    parser.add_argument('--num_updates', type=int, default=8)
+    parser.add_argument('--num_warmups', type=int, default=2)
+    args = parser.parse_args()
+
+    assert args.batch_size % args.num_accum_steps == 0, 'Batch size must be a multiple of num_accum_steps!'
+    micro_batch_size = args.batch_size / args.num_accum_steps
+
+    meta = Meta(working_dir=os.path.join('/tmp', 'bench-accum-%d' % os.getpid()), class_names=['class%d' % num_class for num_class in xrange(args.num_classes)])
+    set_meta(meta)
+
+    preprocess = Preprocess()
+    net = ResNet50(
+        learning_modes=dict(normal=1.0, slow=1.0),
+        num_accum_steps=args.num_accum_steps,
+        resnet_params_path=None,
+        is_train=True)
+
+    image = tf.placeholder(dtype=tf.uint8, shape=(micro_batch_size,) + preprocess.shape)
+    label = tf.placeholder(dtype=tf.int64, shape=(micro_batch_size,))
+    Blob(images=image, labels=label).func(preprocess.normalize).func(net.build)
+    net.sess.run(net.phase_assign, feed_dict={net.phase: Net.Phase.TRAIN.value})
+
+    feed_dict = {
+        image: np.random.randint(256, size=(micro_batch_size,) + preprocess.shape).astype(np.uint8),
+        label: np.random.randint(args.num_classes, size=micro_batch_size)}
+
+    for num_step in xrange(args.num_warmups * args.num_accum_steps):
+        net.sess.run(net.train_op, feed_dict=feed_dict)
+
+    start = time.time()
+    for num_step in xrange(args.num_updates * args.num_accum_steps):
+        net.sess.run(net.train_op, feed_dict=feed_dict)
+    duration = time.time() - start
+
+    global_step = net.sess.run(net.global_step)
+    speed = args.num_updates * args.batch_size / duration
+    peak_rss = get_peak_rss() / 2. ** 20
+    print('num_accum_steps=%d, micro-batch %d: %.1f images/s, %.2f s per update, peak RSS %.1f MB, global_step %d' % (
+        args.num_accum_steps, micro_batch_size, speed, duration / args.num_updates, peak_rss, global_step))
+
+    with open(RESULTS_PATH, 'a') as f:
+        f.write('%d\t%d\t%d\t%.1f\t%.1f\n' % (args.batch_size, args.num_accum_steps, micro_batch_size, speed, peak_rss))
+    print('Results appended to %s' % RESULTS_PATH)
@@ -0,0 +1,43 @@
+from __future__ import print_function
+
+import argparse
+import numpy as np
+import os
+import tensorflow as tf
+import time
+
+from ResNet import ImageUtil, Preprocess
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark full-resolution against reduced-resolution JPEG decoding.')
+    parser.add_argument('image_dir', help='Directory of .jpg files, searched recursively')
+    parser.add_argument('--size', type=int, default=Preprocess.TRAIN_SIZE_RANGE[1], help='Target shorter side')
+    parser.add_argument('--num_images', type=int, default=1000)
+    args = parser.parse_args()
+
+    filename_list = list()
+    for (file_dir, _, file_names) in os.walk(args.image_dir):
+        for file_name in file_names:
+            if file_name.endswith('.jpg'):
+                filename_list.append(os.path.join(file_dir, file_name))
+    filename_list = filename_list[:args.num_images]
+    contents_list = [open(filename, 'rb').read() for filename in filename_list]
+
+    contents = tf.placeholder(dtype=tf.string, shape=())
+    images = {
+        'full': tf.image.decode_jpeg(contents),
+        'reduced': ImageUtil.decode_jpeg(contents, size=args.size)}
+    shorter_sizes = {name: tf.reduce_min(tf.shape(image)[:2]) for (name, image) in images.iteritems()}
+
+    sess = tf.Session()
+    for (name, shorter_size) in sorted(shorter_sizes.iteritems()):
+        sess.run(shorter_size, feed_dict={contents: contents_list[0]})
+
+        sizes = list()
+        start = time.time()
+        for contents_ in contents_list:
+            sizes.append(sess.run(shorter_size, feed_dict={contents: contents_}))
+        duration = time.time() - start
+
+        print('%s: %d images, %.1f images/s, mean shorter side %.1f, min shorter side %d' % (
+            name, len(contents_list), len(contents_list) / duration, np.mean(sizes), np.min(sizes)))
@@ -0,0 +1,53 @@
+from __future__ import print_function
+
+import argparse
+import numpy as np
+import tensorflow as tf
+import time
+
+from ResNet import QueueProducer
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark per-image against bulk QueueProducer enqueueing.')
+    parser.add_argument('--num_images', type=int, default=4096)
+    parser.add_argument('--size', type=int, default=256)
+    parser.add_argument('--feed_size', type=int, default=QueueProducer.FEED_SIZE)
+    args = parser.parse_args()
+
+    producer = QueueProducer(capacity=args.num_images, feed_size=args.feed_size)
+    blob = producer.blob(shape=None, dtype=tf.uint8)
+    size = producer.queue.size()
+    dequeue = producer.queue.dequeue()
+
+    images = np.random.randint(256, size=(args.num_images, args.size, args.size, 3)).astype(np.uint8)
+    variable_images = [image[:np.random.randint(args.size / 2, args.size), :np.random.randint(args.size / 2, args.size)] for image in images]
+
+    def drain(sess):
+        for _ in xrange(sess.run(size)):
+            sess.run(dequeue)
+
+    def per_image(sess):
+        for image in images:
+            kwargs = producer.kwargs(image)
+            sess.run(kwargs['fetch'], feed_dict=kwargs['feed_dict'])
+
+    def bulk(sess):
+        for start in xrange(0, args.num_images, args.feed_size):
+            kwargs = producer.kwargs_many(images[start:start + args.feed_size])
+            sess.run(kwargs['fetch'], feed_dict=kwargs['feed_dict'])
+
+    def packed(sess):
+        for start in xrange(0, args.num_images, args.feed_size):
+            kwargs = producer.kwargs_many(variable_images[start:start + args.feed_size])
+            sess.run(kwargs['fetch'], feed_dict=kwargs['feed_dict'])
+
+    def feeder(sess):
+        producer.feed(sess, iter(images)).join()
+
+    sess = tf.Session()
+    for (name, func) in [('per-image', per_image), ('bulk', bulk), ('packed', packed), ('feeder', feeder)]:
+        start = time.time()
+        func(sess)
+        duration = time.time() - start
+        print('%s: %.1f images/s' % (name, args.num_images / duration))
+        drain(sess)
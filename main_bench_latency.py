@@ -0,0 +1,175 @@
+from __future__ import print_function
+
+import argparse
+import json
+import numpy as np
+import os
+import resource
+import subprocess
+import sys
+import tensorflow as tf
+import threading
+import time
+
+from ResNet import ROOT_PATH, set_meta, Meta, Blob, ImageUtil, Preprocess, Net, ResNet50
+
+BASELINE_PATH = os.path.join(ROOT_PATH, 'bench-latency.json')
+BATCH_SIZES = [1, 4, 16]
+CONCURRENCIES = [1, 2, 4]
+PERCENTILES = (50, 95, 99)
+IMAGE_SIZE_RANGE = (256, 640)
+LOWER_IS_BETTER = ['p%d' % percentile for percentile in PERCENTILES] + ['peak_rss']
+HIGHER_IS_BETTER = ['throughput']
+
+
+def get_peak_rss():
+    if os.path.isfile('/proc/self/status'):
+        for line in open('/proc/self/status'):
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) * 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def make_jpegs(num_jpegs, size_range=IMAGE_SIZE_RANGE, seed=0):
+    random = np.random.RandomState(seed)
+
+    with tf.Graph().as_default():
+        image = tf.placeholder(dtype=tf.uint8, shape=(None, None, 3))
+        contents = tf.image.encode_jpeg(image, quality=90)
+
+        with tf.Session() as sess:
+            contents_list = list()
+            for num_jpeg in xrange(num_jpegs):
+                (height, width) = random.randint(size_range[0], size_range[1] + 1, size=2)
+                image_ = random.randint(256, size=(height / 16 + 1, width / 16 + 1, 3)).astype(np.uint8)
+                image_ = np.repeat(np.repeat(image_, 16, axis=0), 16, axis=1)[:height, :width]
+                contents_list.append(sess.run(contents, feed_dict={image: image_}))
+
+    return contents_list
+
+
+def run(net, contents, fetch, contents_list, batch_size, concurrency, num_requests, num_warmups):
+    random = np.random.RandomState(batch_size * 1000 + concurrency)
+    requests = [[contents_list[index] for index in random.randint(len(contents_list), size=batch_size)] for _ in xrange(concurrency * (num_requests + num_warmups))]
+
+    latencies = [list() for _ in xrange(concurrency)]
+
+    def worker(num_worker):
+        for (num_request, request) in enumerate(requests[num_worker::concurrency]):
+            start = time.time()
+            net.sess.run(fetch, feed_dict={contents: request})
+            if num_request >= num_warmups:
+                latencies[num_worker].append(time.time() - start)
+
+    threads = [threading.Thread(target=worker, args=(num_worker,)) for num_worker in xrange(concurrency)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.time() - start
+
+    latencies = 1000 * np.concatenate(latencies)
+    result = {'p%d' % percentile: float(np.percentile(latencies, percentile)) for percentile in PERCENTILES}
+    result['throughput'] = len(requests) * batch_size / duration
+    result['peak_rss'] = get_peak_rss() / 2. ** 20
+    return result
+
+
+def run_subprocess(batch_size, concurrency):
+    args = [sys.executable, os.path.abspath(__file__)] + sys.argv[1:] + ['--config', str(batch_size), str(concurrency)]
+    return json.loads(subprocess.check_output(args).strip().split('\n')[-1])
+
+
+def compare(results, baseline, tolerance):
+    regressions = list()
+    for (name, result) in sorted(results.iteritems()):
+        if name not in baseline:
+            continue
+        for key in LOWER_IS_BETTER:
+            if result[key] > baseline[name][key] * (1 + tolerance):
+                regressions.append('%s %s: %.1f > %.1f' % (name, key, result[key], baseline[name][key]))
+        for key in HIGHER_IS_BETTER:
+            if result[key] < baseline[name][key] * (1 - tolerance):
+                regressions.append('%s %s: %.1f < %.1f' % (name, key, result[key], baseline[name][key]))
+    return regressions
+
+
+def bench(args):
+    if args.working_dir is None:
+        meta = Meta(working_dir=os.path.join('/tmp', 'bench-latency-%d' % os.getpid()), class_names=['class%d' % num_class for num_class in xrange(args.num_classes)])
+        resnet_params_path = None
+    else:
+        meta = Meta.test(working_dir=args.working_dir)
+        resnet_params_path = ResNet50.RESNET_PARAMS_PATH
+    set_meta(meta)
+
+    contents_list = make_jpegs(args.num_jpegs)
+    print('%d synthetic JPEGs, mean %.1f KB' % (len(contents_list), np.mean(map(len, contents_list)) / 2. ** 10))
+
+    preprocess = Preprocess(num_test_crops=args.num_test_crops)
+    net = ResNet50(
+        resnet_params_path=resnet_params_path,
+        num_test_crops=args.num_test_crops)
+    if args.working_dir is not None:
+        assert os.path.isfile(net.model_path), 'No model found in %s!' % args.working_dir
+
+    contents = tf.placeholder(dtype=tf.string, shape=(None,))
+    image = tf.map_fn(
+        lambda contents_: preprocess._test(ImageUtil.decode_jpeg(contents_, size=preprocess.test_size_range[1])),
+        contents,
+        dtype=tf.uint8)
+    image = tf.reshape(image, (-1,) + preprocess.shape)
+    label = tf.zeros(tf.shape(contents), dtype=tf.int64)
+    Blob(images=image, labels=label).func(preprocess.normalize).func(net.build)
+    net.sess.run(net.phase_assign, feed_dict={net.phase: Net.Phase.TEST.value})
+
+    (batch_size, concurrency) = args.config
+    return run(net, contents, net.prob, contents_list, batch_size, concurrency, args.num_requests, args.num_warmups)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark end-to-end ResNet50 inference latency on synthetic JPEG requests.')
+    parser.add_argument('--working_dir', default=None, help='Directory holding a trained model, random initialization if omitted')
+    parser.add_argument('--num_classes', type=int, default=1000, help='Number of classes for a randomly initialized net')
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=BATCH_SIZES)
+    parser.add_argument('--concurrencies', type=int, nargs='+', default=CONCURRENCIES)
+    parser.add_argument('--num_jpegs', type=int, default=64)
+    parser.add_argument('--num_requests', type=int, default=32, help='Timed requests per worker')
+    parser.add_argument('--num_warmups', type=int, default=4, help='Untimed requests per worker')
+    parser.add_argument('--num_test_crops', type=int, default=Preprocess.NUM_TEST_CROPS)
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--tolerance', type=float, default=0.1, help='Allowed relative regression against the baseline')
+    parser.add_argument('--save_baseline', action='store_true', help='Overwrite the baseline with this run')
+    parser.add_argument('--config', type=int, nargs=2, default=None, help='Run a single batch size and concurrency in this process and print the result as JSON')
+    args = parser.parse_args()
+
+    if args.config is not None:
+        print(json.dumps(bench(args)))
+        sys.exit(0)
+
+    results = dict()
+    for batch_size in args.batch_sizes:
+        for concurrency in args.concurrencies:
+            name = 'batch_size=%d,concurrency=%d' % (batch_size, concurrency)
+            results[name] = run_subprocess(batch_size, concurrency)
+            print('%s: %s' % (name, ', '.join('%s %.1f' % (key, results[name][key]) for key in LOWER_IS_BETTER + HIGHER_IS_BETTER)))
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+        print('Baseline saved to %s' % args.baseline)
+    elif os.path.isfile(args.baseline):
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print('Regressions beyond %.0f%% of %s:' % (100 * args.tolerance, args.baseline))
+            for regression in regressions:
+                print('  %s' % regression)
+            sys.exit(1)
+        print('No regressions beyond %.0f%% of %s' % (100 * args.tolerance, args.baseline))
+    else:
+        print('No baseline found at %s, run with --save_baseline to create one' % args.baseline)
+        sys.exit(1)
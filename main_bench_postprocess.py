@@ -0,0 +1,48 @@
+from __future__ import print_function
+
+import argparse
+import numpy as np
+import tensorflow as tf
+import time
+
+from ResNet import set_meta, Meta, Postprocess
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark per-row against vectorized postprocessing.')
+    parser.add_argument('--batch_size', type=int, default=16384)
+    parser.add_argument('--num_classes', type=int, default=2048)
+    parser.add_argument('--top_k', type=int, default=5)
+    args = parser.parse_args()
+
+    class_names = ['class_%d' % num_class for num_class in xrange(args.num_classes)]
+    set_meta(Meta(class_names=class_names))
+
+    logits = np.random.randn(args.batch_size, args.num_classes).astype(np.float32) * 4
+    prob = np.exp(logits - logits.max(axis=1, keepdims=True))
+    prob = prob / prob.sum(axis=1, keepdims=True)
+    consistency = np.random.uniform(size=(args.batch_size,)).astype(np.float32)
+
+    postprocess = Postprocess(top_k=args.top_k, min_prob=0.5, min_consistency=0.5)
+
+    start = time.time()
+    for (prob_, consistency_) in zip(prob, consistency):
+        indices = np.argsort(-prob_)[:args.top_k]
+        names = [class_names[index] for index in indices]
+        name = names[0] if (prob_[indices[0]] >= 0.5 and consistency_ >= 0.5) else Postprocess.UNKNOWN_NAME
+    print('loop: %.1f rows/s' % (args.batch_size / (time.time() - start)))
+
+    start = time.time()
+    postprocess.apply(prob, consistency)
+    print('numpy: %.1f rows/s' % (args.batch_size / (time.time() - start)))
+
+    prob_ = tf.placeholder(dtype=tf.float32, shape=(None, args.num_classes))
+    consistency_ = tf.placeholder(dtype=tf.float32, shape=(None,))
+    postprocess.blob([prob_, consistency_]).func(postprocess.build)
+
+    sess = tf.Session()
+    feed_dict = {prob_: prob, consistency_: consistency}
+    sess.run(postprocess.kwargs()['fetch'], feed_dict=feed_dict)
+
+    start = time.time()
+    sess.run(postprocess.kwargs()['fetch'], feed_dict=feed_dict)
+    print('graph: %.1f rows/s' % (args.batch_size / (time.time() - start)))
@@ -0,0 +1,50 @@
+from __future__ import print_function
+
+import argparse
+import numpy as np
+import os
+import shutil
+import tempfile
+
+from ResNet import Timer
+from Retrieval import normalize, recall, benchmark, BruteForceIndex, IVFIndex
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark IVF retrieval recall and throughput against brute-force search.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100000, 1000000, 4000000])
+    parser.add_argument('--num_dims', type=int, default=2048)
+    parser.add_argument('--num_clusters', type=int, default=4096)
+    parser.add_argument('--num_queries', type=int, default=1024)
+    parser.add_argument('--batch_size', type=int, default=256)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--num_probes', type=int, nargs='+', default=[4, 16, 64])
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    centers = normalize(np.random.randn(args.num_clusters, args.num_dims))
+
+    for size in args.sizes:
+        feat = np.lib.format.open_memmap(os.path.join(work_dir, 'feat.npy'), mode='w+', dtype=np.float16, shape=(size, args.num_dims))
+        for start in xrange(0, size, 65536):
+            num_rows = min(65536, size - start)
+            clusters = np.random.randint(args.num_clusters, size=num_rows)
+            feat[start:start + num_rows] = normalize(centers[clusters] + 0.5 * np.random.randn(num_rows, args.num_dims) / np.sqrt(args.num_dims)).astype(np.float16)
+        feat.flush()
+
+        queries = feat[np.random.choice(size, args.num_queries, replace=False)].astype(np.float32)
+        queries = normalize(queries + 0.1 * np.random.randn(*queries.shape) / np.sqrt(args.num_dims))
+
+        with Timer('Building index for %d images...' % size):
+            index = IVFIndex.build(feat, os.path.join(work_dir, 'index'), num_lists=int(4 * np.sqrt(size)))
+
+        (true_ids, qps) = benchmark(BruteForceIndex(feat), queries, args.k, args.batch_size)
+        print('size=%d, brute force: %.1f queries/s' % (size, qps))
+
+        for num_probes in args.num_probes:
+            index.num_probes = num_probes
+            (ids, qps) = benchmark(index, queries, args.k, args.batch_size)
+            print('size=%d, num_probes=%d: recall@%d=%.4f, %.1f queries/s' % (size, num_probes, args.k, recall(ids, true_ids), qps))
+
+        del feat, index
+
+    shutil.rmtree(work_dir)
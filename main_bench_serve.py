@@ -0,0 +1,118 @@
+from __future__ import print_function
+
+import argparse
+import json
+import numpy as np
+import os
+import subprocess
+import sys
+import tensorflow as tf
+import time
+
+from ResNet import set_meta, Meta, Blob, ImageUtil, Preprocess, Net, ResNet50, SharedResNet50
+from main_bench_latency import PERCENTILES, get_peak_rss, make_jpegs
+
+MODES = ['separate', 'shared']
+
+
+def build_input(preprocess):
+    contents = tf.placeholder(dtype=tf.string, shape=(None,))
+    image = tf.map_fn(
+        lambda contents_: preprocess._test(ImageUtil.decode_jpeg(contents_, size=preprocess.test_size_range[1])),
+        contents,
+        dtype=tf.uint8)
+    image = tf.reshape(image, (-1,) + preprocess.shape)
+    label = tf.zeros(tf.shape(contents), dtype=tf.int64)
+    return (contents, Blob(images=image, labels=label).func(preprocess.normalize))
+
+
+def build_separate(working_dirs, preprocess):
+    servers = list()
+    for working_dir in working_dirs:
+        with tf.Graph().as_default():
+            set_meta(Meta.test(working_dir=working_dir))
+            net = ResNet50(working_dir=working_dir, num_test_crops=preprocess.num_test_crops)
+            assert os.path.isfile(net.model_path), 'No model found in %s!' % working_dir
+
+            (contents, blob) = build_input(preprocess)
+            blob.func(net.build)
+            net.sess.run(net.phase_assign, feed_dict={net.phase: Net.Phase.TEST.value})
+            servers.append((net, contents))
+
+    return lambda request: [net.sess.run(net.prob, feed_dict={contents: request}) for (net, contents) in servers]
+
+
+def build_shared(working_dirs, preprocess):
+    net = SharedResNet50(working_dirs, num_test_crops=preprocess.num_test_crops)
+
+    (contents, blob) = build_input(preprocess)
+    blob.func(net.build)
+    net.sess.run(net.phase_assign, feed_dict={net.phase: Net.Phase.TEST.value})
+
+    fetch = [head['prob'] for head in net.heads]
+    return lambda request: net.sess.run(fetch, feed_dict={contents: request})
+
+
+def bench(args):
+    contents_list = make_jpegs(args.num_jpegs)
+    preprocess = Preprocess(num_test_crops=args.num_test_crops)
+
+    start = time.time()
+    if args.mode == 'separate':
+        serve = build_separate(args.working_dirs, preprocess)
+    elif args.mode == 'shared':
+        serve = build_shared(args.working_dirs, preprocess)
+    build_duration = time.time() - start
+
+    random = np.random.RandomState(args.batch_size)
+    requests = [[contents_list[index] for index in random.randint(len(contents_list), size=args.batch_size)] for _ in xrange(args.num_requests + args.num_warmups)]
+
+    latencies = list()
+    for (num_request, request) in enumerate(requests):
+        start = time.time()
+        serve(request)
+        if num_request >= args.num_warmups:
+            latencies.append(time.time() - start)
+
+    latencies = 1000 * np.array(latencies)
+    result = {'p%d' % percentile: float(np.percentile(latencies, percentile)) for percentile in PERCENTILES}
+    result['throughput'] = args.batch_size / np.mean(latencies) * 1000
+    result['peak_rss'] = get_peak_rss() / 2. ** 20
+    result['build'] = build_duration
+    return result
+
+
+def run_subprocess(mode):
+    args = [sys.executable, os.path.abspath(__file__)] + sys.argv[1:] + ['--mode', mode]
+    return json.loads(subprocess.check_output(args).strip().split('\n')[-1])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare serving several ResNet50 heads on a shared trunk against one ResNet50 per model.')
+    parser.add_argument('working_dirs', nargs='+', help='Working directories of ResNet50 models fine-tuned from the same trunk')
+    parser.add_argument('--batch_size', type=int, default=4)
+    parser.add_argument('--num_jpegs', type=int, default=64)
+    parser.add_argument('--num_requests', type=int, default=64, help='Timed requests')
+    parser.add_argument('--num_warmups', type=int, default=4, help='Untimed requests')
+    parser.add_argument('--num_test_crops', type=int, default=Preprocess.NUM_TEST_CROPS)
+    parser.add_argument('--mode', choices=MODES, default=None, help='Run a single mode in this process and print the result as JSON')
+    args = parser.parse_args()
+
+    if args.mode is not None:
+        print(json.dumps(bench(args)))
+        sys.exit(0)
+
+    results = dict()
+    for mode in MODES:
+        results[mode] = run_subprocess(mode)
+        print('%s: %s' % (mode, ', '.join('%s %.1f' % (key, value) for (key, value) in sorted(results[mode].iteritems()))))
+
+    (separate, shared) = (results['separate'], results['shared'])
+    print('%d models, batch of %d: p50 %.2fx faster, throughput %.2fx, peak RSS %.1f MB -> %.1f MB (%.1f%% saved)' % (
+        len(args.working_dirs),
+        args.batch_size,
+        separate['p50'] / shared['p50'],
+        shared['throughput'] / separate['throughput'],
+        separate['peak_rss'],
+        shared['peak_rss'],
+        100 * (1 - shared['peak_rss'] / separate['peak_rss'])))
@@ -0,0 +1,21 @@
+from __future__ import print_function
+
+import argparse
+import numpy as np
+
+from ResNet import Timer
+from Retrieval import FeatureStore, IVFIndex
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build a similar-dish index from the feature chunks of main_classify.py --feat.')
+    parser.add_argument('chunk_dir', help='Output directory of main_classify.py')
+    parser.add_argument('store_dir', help='Directory for the float16 feature matrix')
+    parser.add_argument('index_dir', help='Directory for the IVF index')
+    parser.add_argument('--num_lists', type=int, default=IVFIndex.NUM_LISTS)
+    args = parser.parse_args()
+
+    with Timer('Collecting features from %s...' % args.chunk_dir):
+        store = FeatureStore.from_chunks(args.chunk_dir, args.store_dir)
+
+    with Timer('Building index with %d lists...' % args.num_lists):
+        IVFIndex.build(store.feat, args.index_dir, ids=np.flatnonzero(store.mask), num_lists=args.num_lists)
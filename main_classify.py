@@ -0,0 +1,175 @@
+from __future__ import print_function
+
+import argparse
+import glob
+import numpy as np
+import os
+import sys
+import threading
+import time
+
+from ResNet import set_meta, Meta, ManifestProducer, Preprocess, Batch, ResNet50, Postprocess
+
+MANIFEST_FILENAME = 'manifest.txt'
+FAILED_FILENAME = 'failed.txt'
+PROGRESS_FILENAME = 'progress.npz'
+CHUNK_FILENAME = 'chunk-%06d.npz'
+FEED_SIZE = 1024
+
+
+def save_atomic(path, save_func):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        save_func(f)
+    os.rename(tmp_path, path)
+
+
+def get_manifest(input_path, output_dir):
+    manifest_path = os.path.join(output_dir, MANIFEST_FILENAME)
+    if not os.path.isfile(manifest_path):
+        if os.path.isdir(input_path):
+            filename_list = list()
+            for (file_dir, dir_names, file_names) in os.walk(input_path):
+                dir_names.sort()
+                for file_name in sorted(file_names):
+                    if file_name.endswith('.jpg'):
+                        filename_list.append(os.path.join(file_dir, file_name))
+        else:
+            filename_list = [line.rstrip('\n') for line in open(input_path) if line.strip()]
+
+        save_atomic(manifest_path, lambda f: f.write(''.join('%s\n' % filename for filename in filename_list)))
+
+    return [line.rstrip('\n') for line in open(manifest_path)]
+
+
+def load_failed(output_dir):
+    failed_path = os.path.join(output_dir, FAILED_FILENAME)
+    if not os.path.isfile(failed_path):
+        return set()
+    return set(line.rstrip('\n') for line in open(failed_path) if line.strip())
+
+
+def load_progress(output_dir, num_files):
+    progress_path = os.path.join(output_dir, PROGRESS_FILENAME)
+    if not os.path.isfile(progress_path):
+        return (np.zeros(num_files, dtype=np.bool), 0)
+
+    progress = np.load(progress_path)
+    done = np.unpackbits(progress['done'])[:num_files].astype(np.bool)
+    num_chunks = int(progress['num_chunks'])
+
+    for chunk_path in glob.glob(os.path.join(output_dir, 'chunk-*.npz*')):
+        if int(os.path.basename(chunk_path)[6:12]) >= num_chunks:
+            os.remove(chunk_path)
+
+    return (done, num_chunks)
+
+
+def save_progress(output_dir, done, num_chunks):
+    save_atomic(
+        os.path.join(output_dir, PROGRESS_FILENAME),
+        lambda f: np.savez(f, done=np.packbits(done), num_chunks=num_chunks))
+
+
+def feed(net, producer, filename_list, indices):
+    for start in xrange(0, len(indices), FEED_SIZE):
+        indices_ = indices[start:start + FEED_SIZE]
+        filenames_ = [filename_list[index] if index >= 0 else filename_list[indices[0]] for index in indices_]
+        kwargs = producer.kwargs(indices_, filenames_)
+        net.sess.run(kwargs['fetch'], feed_dict=kwargs['feed_dict'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Classify a directory or manifest of images in resumable chunks.')
+    parser.add_argument('input_path', help='Directory of .jpg files, or a manifest with one path per line')
+    parser.add_argument('working_dir', help='Directory holding the trained model and class names')
+    parser.add_argument('output_dir')
+    parser.add_argument('--batch_size', type=int, default=256, help='Crops per batch, a multiple of the number of test crops')
+    parser.add_argument('--num_inputs', type=int, default=ManifestProducer.NUM_INPUTS)
+    parser.add_argument('--chunk_size', type=int, default=65536)
+    parser.add_argument('--top_k', type=int, default=Postprocess.TOP_K)
+    parser.add_argument('--feat', action='store_true', help='Also store the pooled features as float16')
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    meta = Meta.test(working_dir=args.working_dir)
+    set_meta(meta)
+
+    filename_list = get_manifest(args.input_path, args.output_dir)
+    (done, num_chunks) = load_progress(args.output_dir, len(filename_list))
+    failed_set = load_failed(args.output_dir)
+    remaining = np.flatnonzero(~done)
+    print('%d / %d images remaining' % (len(remaining), len(filename_list)))
+    if len(remaining) == 0:
+        sys.exit(0)
+
+    producer = ManifestProducer(num_inputs=args.num_inputs)
+    preprocess = Preprocess()
+    batch = Batch(batch_size=args.batch_size)
+    postprocess = Postprocess(top_k=args.top_k)
+    net = ResNet50()
+    assert os.path.isfile(net.model_path), 'No model found in %s!' % args.working_dir
+
+    blob = producer.blob(decode_size=preprocess.test_size_range[1]).func(preprocess.test).func(batch.test)
+    blob.func(preprocess.normalize).func(net.build)
+    postprocess.blob([net.prob, net.consistency]).func(postprocess.build)
+
+    test_batch_size = batch.batch_size / batch.num_test_crops
+    num_steps = (len(remaining) - 1) / test_batch_size + 1
+    indices = np.concatenate([remaining, -np.ones(num_steps * test_batch_size - len(remaining), dtype=np.int64)])
+
+    fetch = dict(
+        index=net.label,
+        consistency=net.consistency,
+        indices=postprocess.indices,
+        scores=postprocess.scores,
+        is_known=postprocess.is_known)
+    if args.feat:
+        fetch['feat'] = net.feat
+
+    net.start()
+    feeder = threading.Thread(target=feed, args=(net, producer, filename_list, indices))
+    feeder.daemon = True
+    feeder.start()
+
+    columns = {key: list() for key in fetch}
+    failed = list()
+    num_buffered = 0
+    num_images = 0
+    start = time.time()
+    chunk_start = start
+    for step in xrange(num_steps):
+        values = net.online(fetch=fetch)
+
+        keep = values['index'] >= 0
+        for key in fetch:
+            columns[key].append(values[key][keep])
+        num_buffered += np.sum(keep)
+        failed.extend(ManifestProducer.failed_index(values['index'][ManifestProducer.is_failed(values['index'])]))
+
+        if (num_buffered >= args.chunk_size) or (step == num_steps - 1):
+            chunk = {key: np.concatenate(value) for (key, value) in columns.iteritems()}
+            if args.feat:
+                chunk['feat'] = chunk['feat'].astype(np.float16)
+
+            save_atomic(os.path.join(args.output_dir, CHUNK_FILENAME % num_chunks), lambda f: np.savez(f, **chunk))
+            done[chunk['index']] = True
+            if failed:
+                failed_set.update(filename_list[index] for index in failed)
+                save_atomic(os.path.join(args.output_dir, FAILED_FILENAME), lambda f: f.write(''.join('%s\n' % filename for filename in sorted(failed_set))))
+                print('Skipped %d unreadable images, listed in %s' % (len(failed), os.path.join(args.output_dir, FAILED_FILENAME)))
+                done[failed] = True
+            num_chunks += 1
+            save_progress(args.output_dir, done, num_chunks)
+
+            now = time.time()
+            num_images += num_buffered
+            print('Chunk %d: %d / %d images, %.1f images/s (chunk), %.1f images/s (total)' % (
+                num_chunks - 1, np.sum(done), len(filename_list), num_buffered / (now - chunk_start), num_images / (now - start)))
+
+            columns = {key: list() for key in fetch}
+            failed = list()
+            num_buffered = 0
+            chunk_start = now
@@ -0,0 +1,99 @@
+from __future__ import print_function
+
+import argparse
+import numpy as np
+import os
+import tensorflow as tf
+import threading
+import time
+
+import Dedup
+from ResNet import FileProducer, ManifestProducer
+
+KEPT_FILENAME = 'kept.txt'
+
+
+def feed(sess, producer, filename_list, indices, feed_size):
+    for start in xrange(0, len(indices), feed_size):
+        indices_ = indices[start:start + feed_size]
+        filenames_ = [filename_list[index] if index >= 0 else filename_list[0] for index in indices_]
+        kwargs = producer.kwargs(indices_, filenames_)
+        sess.run(kwargs['fetch'], feed_dict=kwargs['feed_dict'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Group near-duplicate images by perceptual hash and keep one per group.')
+    parser.add_argument('image_dir', help='Directory of .jpg files, searched recursively')
+    parser.add_argument('output_dir')
+    parser.add_argument('--max_distance', type=int, default=Dedup.MAX_DISTANCE, help='Largest Hamming distance between near-duplicates')
+    parser.add_argument('--window', type=int, default=Dedup.WINDOW, help='Neighbours compared within each hash band bucket')
+    parser.add_argument('--num_inputs', type=int, default=ManifestProducer.NUM_INPUTS)
+    parser.add_argument('--batch_size', type=int, default=256)
+    parser.add_argument('--subsample_size', type=int, default=FileProducer.SUBSAMPLE_SIZE, help='Train/test split modulus used by FileProducer')
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    filename_list = list()
+    for (file_dir, dir_names, file_names) in os.walk(args.image_dir):
+        dir_names.sort()
+        for file_name in sorted(file_names):
+            if file_name.endswith('.jpg'):
+                filename_list.append(os.path.join(file_dir, file_name))
+    num_files = len(filename_list)
+    print('%d images found in %s' % (num_files, args.image_dir))
+
+    producer = ManifestProducer(num_inputs=args.num_inputs)
+    blob = producer.blob(decode_size=Dedup.DECODE_SIZE)
+    (bits, index) = tf.train.batch_join(
+        [(Dedup.phash(image), label) for (image, label) in blob.as_tuple_list()],
+        batch_size=args.batch_size,
+        capacity=4 * args.batch_size)
+
+    num_steps = (num_files - 1) / args.batch_size + 1
+    indices = np.concatenate([np.arange(num_files), -np.ones(num_steps * args.batch_size - num_files, dtype=np.int64)])
+
+    sess = tf.Session()
+    tf.train.start_queue_runners(sess=sess)
+    feeder = threading.Thread(target=feed, args=(sess, producer, filename_list, indices, 4 * args.batch_size))
+    feeder.daemon = True
+    feeder.start()
+
+    hashes = np.zeros(num_files, dtype=np.uint64)
+    is_failed = np.zeros(num_files, dtype=np.bool)
+    start = time.time()
+    for step in xrange(num_steps):
+        (bits_, index_) = sess.run([bits, index])
+        keep = index_ >= 0
+        hashes[index_[keep]] = Dedup.pack(bits_[keep])
+        is_failed[ManifestProducer.failed_index(index_[ManifestProducer.is_failed(index_)])] = True
+        print('\033[2K\rHashing %d / %d' % (min((step + 1) * args.batch_size, num_files), num_files), end='')
+    hash_duration = time.time() - start
+    print('')
+
+    start = time.time()
+    valid = np.flatnonzero(~is_failed)
+    pairs = valid[Dedup.find_pairs(hashes[valid], max_distance=args.max_distance, window=args.window)]
+    labels = Dedup.connected_components(num_files, pairs)
+    index_duration = time.time() - start
+
+    sizes = np.array([os.path.getsize(filename) for filename in filename_list], dtype=np.float64)
+    keep = Dedup.select_representatives(labels, sizes)
+
+    is_test = np.array([Dedup.is_test(filename, args.subsample_size) for filename in filename_list])
+    group_has_test = np.bincount(labels, weights=is_test, minlength=num_files) > 0
+    group_has_train = np.bincount(labels, weights=~is_test, minlength=num_files) > 0
+    num_groups = len(np.unique(labels))
+    num_leaking_groups = np.sum(group_has_test & group_has_train)
+    num_leaking_test = np.sum(is_test & group_has_train[labels])
+
+    with open(os.path.join(args.output_dir, KEPT_FILENAME), 'w') as f:
+        f.write(''.join('%s\n' % filename for (filename, keep_) in zip(filename_list, keep) if keep_))
+    Dedup.save_duplicates(os.path.join(args.output_dir, Dedup.DUPLICATES_FILENAME), filename_list, labels, keep)
+
+    print('Hashing: %.1f images/s over %d readers, %d unreadable images left ungrouped' % (num_files / hash_duration, args.num_inputs, np.sum(is_failed)))
+    print('Index: %d near-duplicate pairs in %.1f s' % (len(pairs), index_duration))
+    print('Corpus: %d -> %d images in %d groups, %.1f%% reduction' % (num_files, np.sum(keep), num_groups, 100.0 * (1 - float(np.sum(keep)) / num_files)))
+    print('Split: %d groups spanned train and test, covering %d test images; one image per group is kept, so none span after dedup' % (num_leaking_groups, num_leaking_test))
+    print('Duplicates listed in %s, set DUPLICATES_PATH in env.py to exclude them from training' % os.path.join(args.output_dir, Dedup.DUPLICATES_FILENAME))
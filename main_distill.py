@@ -0,0 +1,70 @@
+from __future__ import print_function
+
+import argparse
+import numpy as np
+import time
+
+from ResNet import set_meta, Meta, Blob, FileProducer, Preprocess, Batch, Net, ResNetStudent
+from env import *
+
+NUM_LATENCY_RUNS = 16
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Distill a trained ResNet50 into a compact student.')
+    parser.add_argument('teacher_dir', help='Working directory of the trained ResNet50 teacher')
+    parser.add_argument('--num_units', type=int, nargs=4, default=ResNetStudent.NUM_UNITS)
+    parser.add_argument('--out_channels', type=int, nargs=4, default=ResNetStudent.OUT_CHANNELS)
+    parser.add_argument('--unit', choices=['basic', 'bottleneck'], default=ResNetStudent.UNIT)
+    parser.add_argument('--temperature', type=float, default=ResNetStudent.TEMPERATURE)
+    parser.add_argument('--distill_weight', type=float, default=ResNetStudent.DISTILL_WEIGHT)
+    args = parser.parse_args()
+
+    meta = Meta(working_dir=WORKING_DIR, class_names=list(Meta.test(working_dir=args.teacher_dir).class_names))
+    meta.save()
+    set_meta(meta)
+
+    producer = FileProducer()
+    preprocess = Preprocess()
+    batch = Batch()
+    net = ResNetStudent(
+        learning_rate=1e-1,
+        learning_rate_decay_steps=LEARNING_RATE_DECAY_STEPS,
+        learning_rate_decay_rate=0.5,
+        num_units=tuple(args.num_units),
+        out_channels=tuple(args.out_channels),
+        unit=args.unit,
+        teacher_dir=args.teacher_dir,
+        temperature=args.temperature,
+        distill_weight=args.distill_weight,
+        is_train=True,
+        is_show=True,
+    )
+
+    trainBlob = producer.trainBlob(image_dir=IMAGE_DIR, check=not IS_IMAGE_ALREADY_CHECKED, decode_size=preprocess.train_decode_size).func(preprocess.train).func(batch.train)
+    testBlob = producer.testBlob(image_dir=IMAGE_DIR, decode_size=preprocess.test_size_range[1]).func(preprocess.test).func(batch.test)
+
+    (image, label) = net.case([
+            (Net.Phase.TRAIN, lambda: trainBlob.as_tuple_list()[0]),
+            (Net.Phase.TEST, lambda: testBlob.as_tuple_list()[0])
+        ],
+        shapes=[(batch.batch_size,) + preprocess.shape, (None,)],
+    )
+    Blob(images=image, labels=label).func(preprocess.normalize).func(net.build)
+
+    net.start()
+    net.train(iteration=ITERATION, save_per=ITERATION)
+
+    values = net.evaluate(producer.num_test_images, fetch=dict(correct=net.correct, teacher_correct=net.teacher_correct))
+    (acc, teacher_acc) = (np.mean(values['correct']), np.mean(values['teacher_correct']))
+    print('Held-out accuracy: student %.4f, teacher %.4f, retention %.2f%%' % (acc, teacher_acc, 100 * acc / teacher_acc))
+
+    images = np.random.uniform(-128, 128, size=(batch.batch_size,) + preprocess.shape).astype(np.float32)
+    latencies = dict()
+    for (name, value) in [('student', net.v8_), ('teacher', net.teacher.v8_)]:
+        net.sess.run(value, feed_dict={net.image: images})
+        start = time.time()
+        for num_run in xrange(NUM_LATENCY_RUNS):
+            net.sess.run(value, feed_dict={net.image: images})
+        latencies[name] = (time.time() - start) / NUM_LATENCY_RUNS
+        print('%s: %.1f ms per batch of %d' % (name, 1000 * latencies[name], batch.batch_size))
+    print('Speedup: %.2fx' % (latencies['teacher'] / latencies['student']))
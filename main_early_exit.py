@@ -0,0 +1,96 @@
+from __future__ import print_function
+
+import argparse
+import numpy as np
+import os
+import shutil
+import time
+
+import Pruning
+from ResNet import set_meta, Meta, Blob, FileProducer, Preprocess, Batch, Net, ResNet50
+from env import *
+
+THRESHOLDS = [0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 0.99]
+NUM_LATENCY_BATCHES = 16
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Train early-exit heads on ResNet50 and report compute saved against accuracy.')
+    parser.add_argument('source_dir', help='Working directory of the trained ResNet50')
+    parser.add_argument('--exit_blocks', nargs='+', default=['4'], help='Blocks followed by an auxiliary head')
+    parser.add_argument('--exit_weight', type=float, default=ResNet50.EXIT_WEIGHT)
+    parser.add_argument('--joint', action='store_true', help='Fine-tune the whole net jointly instead of the heads alone')
+    parser.add_argument('--iteration', type=int, default=1000)
+    parser.add_argument('--learning_rate', type=float, default=1e-2)
+    parser.add_argument('--thresholds', type=float, nargs='+', default=THRESHOLDS)
+    args = parser.parse_args()
+
+    meta = Meta(working_dir=WORKING_DIR, class_names=list(Meta.test(working_dir=args.source_dir).class_names))
+    meta.save()
+    set_meta(meta)
+
+    model_path = os.path.join(WORKING_DIR, Net.MODEL_FILENAME)
+    if not os.path.isfile(model_path):
+        shutil.copy(os.path.join(args.source_dir, Net.MODEL_FILENAME), model_path)
+    channels_path = os.path.join(args.source_dir, Pruning.CHANNELS_FILENAME)
+    if os.path.isfile(channels_path):
+        shutil.copy(channels_path, WORKING_DIR)
+
+    if args.joint:
+        learning_modes = dict(normal=1.0, slow=0.1, exit=1.0)
+    else:
+        learning_modes = dict(normal=0.0, slow=0.0, exit=1.0)
+
+    producer = FileProducer()
+    preprocess = Preprocess()
+    batch = Batch()
+    net = ResNet50(
+        learning_rate=args.learning_rate,
+        learning_modes=learning_modes,
+        exit_blocks=args.exit_blocks,
+        exit_weight=args.exit_weight,
+        is_train=True,
+        is_show=True,
+    )
+
+    trainBlob = producer.trainBlob(image_dir=IMAGE_DIR, check=False, decode_size=preprocess.train_decode_size).func(preprocess.train).func(batch.train)
+    testBlob = producer.testBlob(image_dir=IMAGE_DIR, decode_size=preprocess.test_size_range[1]).func(preprocess.test).func(batch.test)
+
+    (image, label) = net.case([
+            (Net.Phase.TRAIN, lambda: trainBlob.as_tuple_list()[0]),
+            (Net.Phase.TEST, lambda: testBlob.as_tuple_list()[0])
+        ],
+        shapes=[(batch.batch_size,) + preprocess.shape, (None,)],
+    )
+    Blob(images=image, labels=label).func(preprocess.normalize).func(net.build)
+
+    net.start()
+    net.train(iteration=args.iteration, save_per=args.iteration)
+
+    fetch = dict(correct=net.exit_correct, saving=net.exit_saving)
+    fetch.update({'exit%s' % name: frac for (name, frac) in net.exit_fracs.iteritems()})
+
+    images = [net.online(fetch=dict(image=net.image))['image'] for _ in xrange(NUM_LATENCY_BATCHES)]
+
+    def get_latency(value, feed_dict=dict()):
+        net.sess.run(value, feed_dict=dict(feed_dict, **{net.image: images[0]}))
+        start = time.time()
+        for image in images:
+            net.sess.run(value, feed_dict=dict(feed_dict, **{net.image: image}))
+        return (time.time() - start) / len(images)
+
+    acc = np.mean(net.evaluate(producer.num_test_images, fetch=dict(correct=net.correct))['correct'])
+    full_latency = get_latency(net.prob)
+    print('Full network: accuracy %.4f, %.2f GFLOPs per crop, %.1f ms per batch' % (acc, net.net_flops / 1e9, 1000 * full_latency))
+
+    for threshold in args.thresholds:
+        values = net.evaluate(producer.num_test_images, feed_dict={net.exit_threshold: threshold}, fetch=fetch)
+        values = {key: np.mean(value) for (key, value) in values.iteritems()}
+        latency = get_latency(net.exit_prob, feed_dict={net.exit_threshold: threshold})
+
+        print('threshold=%.2f: accuracy %.4f, compute saved %.1f%%, exits %s, %.1f ms per batch, %.2fx measured speedup' % (
+            threshold,
+            values['correct'],
+            100 * values['saving'],
+            ', '.join('%s %.1f%%' % (name, 100 * values['exit%s' % name]) for name in net.exit_blocks),
+            1000 * latency,
+            full_latency / latency))
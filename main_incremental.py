@@ -0,0 +1,73 @@
+from __future__ import print_function
+
+import argparse
+import numpy as np
+import os
+import shutil
+import time
+
+import Pruning
+from ResNet import set_meta, Meta, Blob, FileProducer, Preprocess, Batch, Net, ResNet50
+from env import *
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Add new classes to a trained ResNet50 by widening fc and fine-tuning the head.')
+    parser.add_argument('source_dir', help='Working directory of the trained ResNet50')
+    parser.add_argument('--num_rehearsal', type=int, default=32, help='Training images kept per old class')
+    parser.add_argument('--iteration', type=int, default=1000)
+    parser.add_argument('--learning_rate', type=float, default=1e-2)
+    parser.add_argument('--normal_rate', type=float, default=0.0, help='Relative learning rate of blocks 4 and 5, the head alone if zero')
+    args = parser.parse_args()
+
+    meta = Meta.incremental(image_dir=IMAGE_DIR, source_dir=args.source_dir, working_dir=WORKING_DIR)
+    set_meta(meta)
+
+    old_class_names = list(Meta.test(working_dir=args.source_dir).class_names)
+    new_class_names = meta.class_names[len(old_class_names):]
+    assert new_class_names, 'No new classes found in %s!' % IMAGE_DIR
+    print('Adding %d classes to %d: %s' % (len(new_class_names), len(old_class_names), ', '.join(new_class_names)))
+
+    model_path = os.path.join(WORKING_DIR, Net.MODEL_FILENAME)
+    if not os.path.isfile(model_path):
+        shutil.copy(os.path.join(args.source_dir, Net.MODEL_FILENAME), model_path)
+    channels_path = os.path.join(args.source_dir, Pruning.CHANNELS_FILENAME)
+    if os.path.isfile(channels_path):
+        shutil.copy(channels_path, WORKING_DIR)
+
+    producer = FileProducer()
+    preprocess = Preprocess()
+    batch = Batch()
+    net = ResNet50(
+        learning_rate=args.learning_rate,
+        learning_modes=dict(normal=args.normal_rate, slow=0.0, fc=1.0),
+        is_train=True,
+        is_show=True,
+    )
+
+    class_limits = {class_name: args.num_rehearsal for class_name in old_class_names}
+    trainBlob = producer.trainBlob(image_dir=IMAGE_DIR, check=not IS_IMAGE_ALREADY_CHECKED, decode_size=preprocess.train_decode_size, class_limits=class_limits).func(preprocess.train).func(batch.train)
+    testBlob = producer.testBlob(image_dir=IMAGE_DIR, decode_size=preprocess.test_size_range[1]).func(preprocess.test).func(batch.test)
+
+    (image, label) = net.case([
+            (Net.Phase.TRAIN, lambda: trainBlob.as_tuple_list()[0]),
+            (Net.Phase.TEST, lambda: testBlob.as_tuple_list()[0])
+        ],
+        shapes=[(batch.batch_size,) + preprocess.shape, (None,)],
+    )
+    Blob(images=image, labels=label).func(preprocess.normalize).func(net.build)
+
+    net.start()
+    start = time.time()
+    net.train(iteration=args.iteration, save_per=args.iteration)
+    duration = time.time() - start
+
+    values = net.evaluate(producer.num_test_images, fetch=dict(label=net.label, correct=net.correct))
+    is_new = values['label'] >= len(old_class_names)
+
+    def get_acc(correct):
+        if len(correct) == 0:
+            return 'n/a'
+        return '%.4f (%d images)' % (np.mean(correct), len(correct))
+
+    print('Fine-tuned in %.1f s: accuracy %s overall, %s on old classes, %s on new classes' % (
+        duration, get_acc(values['correct']), get_acc(values['correct'][~is_new]), get_acc(values['correct'][is_new])))
@@ -0,0 +1,72 @@
+from __future__ import print_function
+
+import argparse
+import os
+import tensorflow as tf
+
+from ResNet import set_meta, Meta, Blob, FileProducer, PrioritySampler, Preprocess, Batch, Net, ResNet50, Curve
+from env import *
+
+CURVE_FILENAME = 'priority-curve.tsv'
+RESULTS_FILENAME = 'priority-results.tsv'
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Train ResNet50 with loss- and class-weighted example sampling and report time to a target accuracy.')
+    parser.add_argument('--uniform', action='store_true', help='Sample uniformly as the reference run')
+    parser.add_argument('--loss_power', type=float, default=PrioritySampler.LOSS_POWER)
+    parser.add_argument('--class_power', type=float, default=PrioritySampler.CLASS_POWER)
+    parser.add_argument('--weight_power', type=float, default=PrioritySampler.WEIGHT_POWER)
+    parser.add_argument('--target_acc', type=float, default=None, help='Validation accuracy to time, e.g. from the --uniform run')
+    parser.add_argument('--eval_per', type=int, default=500)
+    args = parser.parse_args()
+
+    meta = Meta.train(image_dir=IMAGE_DIR, working_dir=WORKING_DIR)
+    set_meta(meta)
+
+    producer = FileProducer()
+    preprocess = Preprocess()
+    batch = Batch()
+    net = ResNet50(
+        learning_rate=1e-1,
+        learning_rate_decay_steps=LEARNING_RATE_DECAY_STEPS,
+        learning_rate_decay_rate=0.5,
+        is_train=True,
+        is_show=True,
+    )
+
+    decode_size = preprocess.train_decode_size
+    if args.uniform:
+        sampler = None
+        trainBlob = producer.trainBlob(image_dir=IMAGE_DIR, check=not IS_IMAGE_ALREADY_CHECKED, decode_size=decode_size).func(preprocess.train).func(batch.train)
+        weight = tf.ones((batch.batch_size,))
+    else:
+        sampler = PrioritySampler(loss_power=args.loss_power, class_power=args.class_power, weight_power=args.weight_power)
+        trainBlob = producer.sampledBlob(image_dir=IMAGE_DIR, sampler=sampler, check=not IS_IMAGE_ALREADY_CHECKED, decode_size=decode_size).func(preprocess.train).func(batch.train).func(sampler.lookup)
+        weight = sampler.weight
+    testBlob = producer.testBlob(image_dir=IMAGE_DIR, decode_size=preprocess.test_size_range[1]).func(preprocess.test).func(batch.test)
+
+    (image, label, example_weight) = net.case([
+            (Net.Phase.TRAIN, lambda: trainBlob.as_tuple_list()[0] + (weight,)),
+            (Net.Phase.TEST, lambda: testBlob.as_tuple_list()[0] + (tf.ones(tf.shape(testBlob.labels[0])),))
+        ],
+        shapes=[(batch.batch_size,) + preprocess.shape, (None,), (None,)],
+    )
+    net.example_weight = example_weight
+    Blob(images=image, labels=label).func(preprocess.normalize).func(net.build)
+
+    net.start()
+    curve = Curve(net, producer.num_test_images)
+    extra_callbacks = [curve.callback(args.eval_per)]
+    if sampler is not None:
+        sampler.feed(net.sess)
+        extra_callbacks.append(sampler.callback(net.example_loss))
+
+    net.train(
+        iteration=ITERATION,
+        save_per=ITERATION,
+        extra_callbacks=extra_callbacks)
+    curve.evaluate()
+
+    name = 'uniform' if args.uniform else 'priority-%.2f-%.2f-%.2f' % (args.loss_power, args.class_power, args.weight_power)
+    curve.save(os.path.join(WORKING_DIR, CURVE_FILENAME))
+    curve.report(name, args.target_acc, os.path.join(os.path.dirname(WORKING_DIR.rstrip('/')), RESULTS_FILENAME))
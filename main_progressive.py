@@ -0,0 +1,68 @@
+from __future__ import print_function
+
+import argparse
+import os
+
+from ResNet import set_meta, Meta, Blob, FileProducer, Preprocess, Batch, Schedule, Net, ResNet50, Curve
+from env import *
+
+CURVE_FILENAME = 'progressive-curve.tsv'
+RESULTS_FILENAME = 'progressive-results.tsv'
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Train ResNet50 with a progressive-resolution schedule and report time to a target accuracy.')
+    parser.add_argument('--fixed', action='store_true', help='Train at a fixed resolution as the reference run')
+    parser.add_argument('--sizes', type=int, nargs='+', default=Schedule.SIZES, help='Crop sizes of equal-length stages')
+    parser.add_argument('--scale_batch', action='store_true', help='Grow the batch size as the crop size shrinks')
+    parser.add_argument('--target_acc', type=float, default=None, help='Validation accuracy to time, e.g. from the --fixed run')
+    parser.add_argument('--eval_per', type=int, default=500)
+    args = parser.parse_args()
+
+    meta = Meta.train(image_dir=IMAGE_DIR, working_dir=WORKING_DIR)
+    set_meta(meta)
+
+    batch_size = Batch.BATCH_SIZE
+    if args.fixed:
+        schedule = None
+    else:
+        schedule = Schedule.progressive(ITERATION, sizes=args.sizes, batch_size=batch_size, is_scale_batch=args.scale_batch)
+
+    producer = FileProducer()
+    preprocess = Preprocess(schedule=schedule)
+    batch = Batch(batch_size=batch_size, schedule=schedule)
+    net = ResNet50(
+        learning_rate=1e-1,
+        learning_rate_decay_steps=LEARNING_RATE_DECAY_STEPS,
+        learning_rate_decay_rate=0.5,
+        is_train=True,
+        is_show=True,
+    )
+
+    trainBlob = producer.trainBlob(image_dir=IMAGE_DIR, check=not IS_IMAGE_ALREADY_CHECKED, decode_size=preprocess.train_decode_size).func(preprocess.train).func(batch.train)
+    testBlob = producer.testBlob(image_dir=IMAGE_DIR, decode_size=preprocess.test_size_range[1]).func(preprocess.test).func(batch.test)
+
+    if schedule is None:
+        image_shape = (batch.batch_size,) + preprocess.shape
+    else:
+        image_shape = (None, None, None, preprocess.net_channel)
+
+    (image, label) = net.case([
+            (Net.Phase.TRAIN, lambda: trainBlob.as_tuple_list()[0]),
+            (Net.Phase.TEST, lambda: testBlob.as_tuple_list()[0])
+        ],
+        shapes=[image_shape, (None,)],
+    )
+    Blob(images=image, labels=label).func(preprocess.normalize).func(net.build)
+
+    net.start()
+    curve = Curve(net, producer.num_test_images)
+    net.train(
+        iteration=ITERATION,
+        save_per=ITERATION,
+        schedule=schedule,
+        extra_callbacks=[curve.callback(args.eval_per)])
+    curve.evaluate()
+
+    name = 'fixed-%d' % preprocess.net_size if args.fixed else 'progressive-%s' % '-'.join(map(str, args.sizes))
+    curve.save(os.path.join(WORKING_DIR, CURVE_FILENAME))
+    curve.report(name, args.target_acc, os.path.join(os.path.dirname(WORKING_DIR.rstrip('/')), RESULTS_FILENAME))
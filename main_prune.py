@@ -0,0 +1,76 @@
+from __future__ import print_function
+
+import argparse
+import numpy as np
+import os
+import time
+
+import Pruning
+from ResNet import set_meta, Meta, Blob, FileProducer, Preprocess, Batch, Net, ResNet50
+from env import *
+
+from deepbox import util
+
+PRUNED_PARAMS_FILENAME = 'pruned-params.mat'
+RESULTS_FILENAME = 'prune-results.tsv'
+NUM_LATENCY_RUNS = 16
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Prune ResNet50 channels by batch-norm gain and fine-tune.')
+    parser.add_argument('source_dir', help='Working directory of the trained ResNet50')
+    parser.add_argument('--ratio', type=float, default=0.5, help='Fraction of branch2a/branch2b channels to remove per unit')
+    parser.add_argument('--iteration', type=int, default=1000, help='Fine-tuning steps')
+    parser.add_argument('--learning_rate', type=float, default=1e-3)
+    args = parser.parse_args()
+
+    meta = Meta(working_dir=WORKING_DIR, class_names=list(Meta.test(working_dir=args.source_dir).class_names))
+    meta.save()
+    set_meta(meta)
+
+    params = Pruning.load_params(os.path.join(args.source_dir, Net.MODEL_FILENAME))
+    channels = Pruning.prune(params, args.ratio, epsilon=util.EPSILON)
+    Pruning.save_params(params, os.path.join(WORKING_DIR, PRUNED_PARAMS_FILENAME))
+    Pruning.save_channels(channels, os.path.join(WORKING_DIR, Pruning.CHANNELS_FILENAME))
+
+    producer = FileProducer()
+    preprocess = Preprocess()
+    batch = Batch()
+    net = ResNet50(
+        learning_rate=args.learning_rate,
+        learning_modes=dict(normal=1.0, slow=0.1),
+        resnet_params_path=os.path.join(WORKING_DIR, PRUNED_PARAMS_FILENAME),
+        channels=channels,
+        is_train=True,
+        is_show=True,
+    )
+
+    trainBlob = producer.trainBlob(image_dir=IMAGE_DIR, check=False, decode_size=preprocess.train_decode_size).func(preprocess.train).func(batch.train)
+    testBlob = producer.testBlob(image_dir=IMAGE_DIR, decode_size=preprocess.test_size_range[1]).func(preprocess.test).func(batch.test)
+
+    (image, label) = net.case([
+            (Net.Phase.TRAIN, lambda: trainBlob.as_tuple_list()[0]),
+            (Net.Phase.TEST, lambda: testBlob.as_tuple_list()[0])
+        ],
+        shapes=[(batch.batch_size,) + preprocess.shape, (None,)],
+    )
+    Blob(images=image, labels=label).func(preprocess.normalize).func(net.build)
+
+    net.start()
+    net.train(iteration=args.iteration, save_per=args.iteration)
+
+    acc = np.mean(net.evaluate(producer.num_test_images, fetch=dict(correct=net.correct))['correct'])
+
+    images = np.random.uniform(-128, 128, size=(batch.batch_size,) + preprocess.shape).astype(np.float32)
+    net.sess.run(net.v8_, feed_dict={net.image: images})
+    start = time.time()
+    for num_run in xrange(NUM_LATENCY_RUNS):
+        net.sess.run(net.v8_, feed_dict={net.image: images})
+    latency = (time.time() - start) / NUM_LATENCY_RUNS
+
+    gflops = net.flops / 1e9
+    print('ratio=%.2f: %.2f GFLOPs per crop, %.1f ms per batch of %d, accuracy %.4f' % (args.ratio, gflops, 1000 * latency, batch.batch_size, acc))
+
+    results_path = os.path.join(os.path.dirname(WORKING_DIR.rstrip('/')), RESULTS_FILENAME)
+    with open(results_path, 'a') as f:
+        f.write('%s\t%.2f\t%.3f\t%.2f\t%.4f\n' % (WORKING_DIR, args.ratio, gflops, 1000 * latency, acc))
+    print('Results appended to %s' % results_path)
@@ -1,3 +1,5 @@
+import Dedup
+from Autotune import Autotune
 from ResNet import set_meta, Meta, Blob, FileProducer, Preprocess, Batch, Net, ResNet50
 from env import *
 
@@ -5,19 +7,39 @@ if __name__ == '__main__':
     meta = Meta.train(image_dir=IMAGE_DIR, working_dir=WORKING_DIR)
     set_meta(meta)
 
-    producer = FileProducer()
+    assert Batch.BATCH_SIZE % NUM_ACCUM_STEPS == 0, 'Batch size must be a multiple of NUM_ACCUM_STEPS!'
+
     preprocess = Preprocess()
-    batch = Batch()
+
+    config = Autotune.load()
+    if config is None:
+        config = Autotune.DEFAULT_CONFIG
+        if IS_AUTOTUNE:
+            config = Autotune(image_dir=IMAGE_DIR, preprocess=preprocess).search()
+            Autotune.save(config)
+
+    producer = FileProducer(
+        capacity=config['capacity'],
+        num_train_inputs=config['num_train_inputs'],
+        exclude_filenames=None if DUPLICATES_PATH is None else Dedup.load_duplicates(DUPLICATES_PATH))
+    batch = Batch(
+        batch_size=Batch.BATCH_SIZE / NUM_ACCUM_STEPS,
+        train_capacity=config['train_capacity'],
+        min_after_dequeue=config['min_after_dequeue'])
     net = ResNet50(
         learning_rate=1e-1,
         learning_rate_decay_steps=LEARNING_RATE_DECAY_STEPS,
         learning_rate_decay_rate=0.5,
+        num_accum_steps=NUM_ACCUM_STEPS,
+        num_intra_threads=config['num_intra_threads'],
+        num_inter_threads=config['num_inter_threads'],
         is_train=True,
         is_show=True,
+        is_profile=True,
     )
 
-    trainBlob = producer.trainBlob(image_dir=IMAGE_DIR, check=not IS_IMAGE_ALREADY_CHECKED).func(preprocess.train).func(batch.train)
-    testBlob = producer.testBlob(image_dir=IMAGE_DIR).func(preprocess.test).func(batch.test)
+    trainBlob = producer.trainBlob(image_dir=IMAGE_DIR, check=not IS_IMAGE_ALREADY_CHECKED, decode_size=preprocess.train_decode_size).func(preprocess.train).func(batch.train)
+    testBlob = producer.testBlob(image_dir=IMAGE_DIR, decode_size=preprocess.test_size_range[1]).func(preprocess.test).func(batch.test)
 
     (image, label) = net.case([
             (Net.Phase.TRAIN, lambda: trainBlob.as_tuple_list()[0]),
@@ -25,7 +47,8 @@ if __name__ == '__main__':
         ],
         shapes=[(batch.batch_size,) + preprocess.shape, (None,)],
     )
-    Blob(images=image, labels=label).func(net.build)
+    Blob(images=image, labels=label).func(preprocess.normalize).func(net.build)
+    net.profiler.add_value('train/queue_fill', batch.train_fill)
 
     net.start()
     net.train(iteration=ITERATION)